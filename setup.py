@@ -51,6 +51,9 @@ setup_args = dict(
     ],
 
     extras_require = {
+        'msgpack': [
+            'msgpack>=0.6',
+        ],
         'test': [
             'pytest',
             'pytest-cov',
@@ -2,15 +2,15 @@
 # Copyright 2019-2020 the .NET Foundation
 # Distributed under the terms of the revised (3-clause) BSD license.
 
-import hashlib
+# NOTE: heavier dependencies (yaml, url_normalize, hashlib, tempfile) are
+# imported inside the functions that need them, so that lightweight uses of
+# this module, and the CLI subcommands that don't touch them, start up fast.
+# Notably, this module never needs to import `requests` at all: callers pass
+# in their own sessions.
+
 from urllib import parse
 import os.path
-import requests
-import sys
-import tempfile
-from url_normalize import url_normalize
 import warnings
-import yaml
 
 from ._version import version_info, __version__  # noqa
 
@@ -20,9 +20,149 @@ version_info
 Database
 Domain
 Record
+RedirectCache
 '''.split()
 
 
+def _normalize_path(path, query, case_sensitive):
+    """Normalize the path and query parts of a URL.
+
+    This implements the path normalization rules of :meth:`Database.normalize`
+    for callers that have already resolved the domain in question.
+
+    """
+    from url_normalize import url_normalize
+
+    # The main WWT web server, being IIS, is case-insensitive in its URL
+    # paths. We define the downcased path as the normal form. We do not
+    # currently normalize the query parts of the URL, which *might* be
+    # case-insensitive depending on how a given API is implemented.
+    if not case_sensitive:
+        path = path.lower()
+
+    # Note that we discard the fragment (for now?).
+    normpath = parse.SplitResult('', '', path, query, '')
+    normpath = normpath.geturl()
+    return url_normalize(normpath)
+
+
+_BLAKE2B_DIGEST_SIZE = 32
+
+
+class _ContentDigester(object):
+    """Compute the digests of some content in one pass.
+
+    If *chunk_size* is given, the SHA256 digests of each consecutive chunk of
+    that many bytes are computed as well as that of the whole. If *blake2b*
+    is true, a BLAKE2b digest is computed too. If *sha256* is false, the
+    SHA256 digest of the whole is skipped, which is worthwhile on CPUs where
+    BLAKE2b is much faster.
+
+    """
+    length = 0
+    chunk_sha256 = None
+    _precomputed = None
+
+    def __init__(self, chunk_size=None, sha256=True, blake2b=False):
+        import hashlib
+
+        self._sha256 = hashlib.sha256() if sha256 else None
+        self._blake2b = hashlib.blake2b(digest_size=_BLAKE2B_DIGEST_SIZE) if blake2b else None
+        self._chunk_size = chunk_size
+
+        if chunk_size is not None:
+            self.chunk_sha256 = []
+            self._chunk = hashlib.sha256()
+            self._chunk_fill = 0
+
+    def update(self, data):
+        if self._sha256 is not None:
+            self._sha256.update(data)
+        if self._blake2b is not None:
+            self._blake2b.update(data)
+
+        self.length += len(data)
+
+        if self._chunk_size is None:
+            return
+
+        import hashlib
+
+        view = memoryview(data)
+
+        while len(view):
+            n = min(len(view), self._chunk_size - self._chunk_fill)
+            self._chunk.update(view[:n])
+            self._chunk_fill += n
+            view = view[n:]
+
+            if self._chunk_fill == self._chunk_size:
+                self.chunk_sha256.append(self._chunk.digest())
+                self._chunk = hashlib.sha256()
+                self._chunk_fill = 0
+
+    def consume(self, resp):
+        """Digest the entire body of the `requests` response *resp*.
+
+        Responses replayed from a recording (see
+        :mod:`wwt_url_database.replay`) may carry precomputed digests in
+        place of a large body, in which case we use those. Chunk digests, and
+        BLAKE2b digests in older recordings, are unavailable in that case.
+
+        """
+        precomputed = getattr(resp, 'wwt_precomputed_digests', None)
+        if precomputed is not None:
+            self.length = precomputed['length']
+            self._precomputed = precomputed
+            self.chunk_sha256 = None
+            return self
+
+        for chunk in resp.iter_content(chunk_size=None):
+            self.update(chunk)
+
+        if self._chunk_size is not None and self._chunk_fill:
+            self.chunk_sha256.append(self._chunk.digest())
+            self._chunk_fill = 0
+
+        return self
+
+    @property
+    def sha256(self):
+        if self._precomputed is not None:
+            return self._precomputed['sha256']
+        if self._sha256 is None:
+            return None
+        return self._sha256.digest()
+
+    @property
+    def blake2b(self):
+        if self._precomputed is not None:
+            return self._precomputed.get('blake2b')
+        if self._blake2b is None:
+            return None
+        return self._blake2b.digest()
+
+
+def _describe_chunks(indices, chunk_size, length):
+    """Summarize a sorted list of chunk indices as byte ranges."""
+
+    ranges = []
+
+    for i in indices:
+        start = i * chunk_size
+        end = min(start + chunk_size, length) - 1
+
+        if ranges and ranges[-1][1] == start - 1:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+
+    text = ', '.join(f'{a}-{b}' for a, b in ranges[:5])
+    if len(ranges) > 5:
+        text += f', and {len(ranges) - 5} more ranges'
+    return text
+
+
 class Record(object):
     _domain = None
 
@@ -38,8 +178,20 @@ class Record(object):
     content_sha256 = None
     "This is a bytes object with binary digest data."
 
+    content_blake2b = None
+    "If not None, a bytes object with a 32-byte binary BLAKE2b digest of the content."
+
+    content_chunk_size = None
+    "If not None, the size of the chunks described by :attr:`content_chunk_sha256`."
+
+    content_chunk_sha256 = None
+    "A list of binary SHA256 digests of consecutive chunks of the content, or None."
+
     content_type = None
 
+    redirect_target = None
+    "For redirect records, the absolute URL that the redirect points to, if known."
+
     def __init__(self, domain, doc):
         self._domain = domain
         self.path = doc.pop('_path')
@@ -49,7 +201,16 @@ class Record(object):
         if self.content_length is not None:
             self.content_sha256 = bytes.fromhex(doc.pop('content-sha256'))
 
+            blake2b = doc.pop('content-blake2b', None)
+            if blake2b is not None:
+                self.content_blake2b = bytes.fromhex(blake2b)
+
+            self.content_chunk_size = doc.pop('content-chunk-size', None)
+            if self.content_chunk_size is not None:
+                self.content_chunk_sha256 = [bytes.fromhex(h) for h in doc.pop('content-chunk-sha256')]
+
         self.categories = set(doc.pop('categories', ()))
+        self.redirect_target = doc.pop('redirect-target', None)
 
         self.extras = doc
 
@@ -62,14 +223,71 @@ class Record(object):
             d['content-length'] = self.content_length
             d['content-sha256'] = self.content_sha256.hex()
 
+            if self.content_blake2b is not None:
+                d['content-blake2b'] = self.content_blake2b.hex()
+
+            if self.content_chunk_size is not None:
+                d['content-chunk-size'] = self.content_chunk_size
+                d['content-chunk-sha256'] = [h.hex() for h in self.content_chunk_sha256]
+
         if len(self.categories):
             d['categories'] = sorted(self.categories)
 
+        if self.redirect_target is not None:
+            d['redirect-target'] = self.redirect_target
+
         return d
 
-    def url(self):
+    def as_tuple(self):
+        """Get a compact, picklable representation of this record.
+
+        This is cheaper to ship between processes than the dict form. The
+        result contains no reference to the record's domain. Use
+        :meth:`from_tuple` to reconstitute a record.
+
+        """
+        return (
+            self.path,
+            self.content_type,
+            self.content_length,
+            self.content_sha256,
+            self.content_blake2b,
+            self.content_chunk_size,
+            tuple(self.content_chunk_sha256) if self.content_chunk_sha256 is not None else None,
+            tuple(sorted(self.categories)),
+            self.redirect_target,
+            self.extras or None,
+        )
+
+    @classmethod
+    def from_tuple(cls, domain, tup):
+        """Reconstitute a record from the output of :meth:`as_tuple`."""
+
+        rec = cls.__new__(cls)
+        rec._domain = domain
+        (
+            rec.path,
+            rec.content_type,
+            rec.content_length,
+            rec.content_sha256,
+            rec.content_blake2b,
+            rec.content_chunk_size,
+            chunk_sha256,
+            categories,
+            rec.redirect_target,
+            extras,
+        ) = tup
+        rec.content_chunk_sha256 = list(chunk_sha256) if chunk_sha256 is not None else None
+        rec.categories = set(categories)
+        rec.extras = dict(extras) if extras else {}
+        return rec
+
+    def url(self, mapped=True):
         """Get the full URL associated with this record.
 
+        If *mapped* is false, any domain mapping activated with
+        :meth:`Database.activate_map` is ignored.
+
         TODO: may be semantically limited. E.g., test both HTTP and HTTPS. And
         cnames. And methods.
 
@@ -87,14 +305,26 @@ class Record(object):
         # allow us to check prototype sites. Trying to activate this
         # functionality in broader circumstances sounds like a recipe for
         # confusion everywhere.
-        netloc = self._domain._db._active_maps.get(netloc, netloc)
+        if mapped:
+            netloc = self._domain._db._active_maps.get(netloc, netloc)
 
         path = self.path  # XXX this can includes a query string!
         query = ''  # ... but urllib doesn't escape magic characters, so we can fake it
         fragment = ''
         return parse.urlunsplit((scheme, netloc, path, query, fragment))
 
-    def initialize(self, session, static=False):
+    def _mapped_redirect_target(self):
+        """Get the expected redirect target, taking domain maps into account.
+
+        If we're checking a prototype site, redirects to the original domain
+        should presumably point at the prototype instead.
+
+        """
+        info = parse.urlsplit(self.redirect_target)
+        netloc = self._domain._db._active_maps.get(info.netloc, info.netloc)
+        return parse.urlunsplit(info._replace(netloc=netloc))
+
+    def initialize(self, session, static=False, chunk_size=None, blake2b=False):
         """Initialize the record for this URL.
 
         At a minimum, we use a GET request to obtain its content-type. (TODO:
@@ -106,6 +336,14 @@ class Record(object):
         the URL at the moment. Subsequent checks might re-download the file
         and check that things still agree.
 
+        If *chunk_size* is also given, we additionally record the digests of
+        each chunk of that many bytes. This allows checks to verify samples of
+        the content with HTTP Range requests, and to pinpoint what changed.
+
+        If *blake2b* is true, we additionally record a BLAKE2b digest of the
+        content, computed in the same pass. This allows cheaper routine
+        checks; see :meth:`check`.
+
         """
         url = self.url()
         resp = session.get(url, stream=True, allow_redirects=False)
@@ -115,43 +353,131 @@ class Record(object):
         if resp.is_redirect:
             # Well, this certainly isn't a hack ...
             self.content_type = f'X-{resp.status_code}-Redirect'
+            self.redirect_target = parse.urljoin(url, resp.headers['location'])
             return
 
         self.content_type = resp.headers['content-type'].split(';')[0]  # ignore `; charset=utf-8`
 
         if static:
-            d = hashlib.sha256()
-            count = 0
+            d = _ContentDigester(chunk_size=chunk_size, blake2b=blake2b).consume(resp)
+            self.content_length = d.length
+            self.content_sha256 = d.sha256  # this is a bytes of the binary digest data
+            self.content_blake2b = d.blake2b
+
+            if chunk_size is not None:
+                self.content_chunk_size = chunk_size
+                self.content_chunk_sha256 = d.chunk_sha256
+            else:
+                self.content_chunk_size = None
+                self.content_chunk_sha256 = None
 
-            for chunk in resp.iter_content(chunk_size=None):
-                d.update(chunk)
-                count += len(chunk)
+    def _verify_content(self, resp, fast_digest=False):
+        """Verify the full body of *resp* against our digests.
 
-            self.content_length = count
-            self.content_sha256 = d.digest()  # this is a bytes of the binary digest data
+        If *fast_digest* is true and we have a BLAKE2b digest, only that is
+        checked. Otherwise the SHA256 digest is checked, along with the
+        BLAKE2b digest if we have one. Returns None if all is well, or a
+        string describing the problem.
 
+        """
+        fast = fast_digest and self.content_blake2b is not None
+        d = _ContentDigester(
+            chunk_size = None if fast else self.content_chunk_size,
+            sha256 = not fast,
+            blake2b = self.content_blake2b is not None,
+        ).consume(resp)
 
-    def check(self, session, content=True):
-        """Check this URL!
+        if d.length != self.content_length:
+            return f'content length changed from {self.content_length} to {d.length}'
 
-        Returns True if the URL had a problem, False if it's OK.
+        if fast and d.blake2b is not None:
+            if d.blake2b != self.content_blake2b:
+                return 'content BLAKE2b changed'
+            return None
+
+        if d.sha256 != self.content_sha256:
+            if self.content_chunk_size is None or d.chunk_sha256 is None:
+                return 'content SHA256 changed'
+
+            bad = [
+                i for i, (old, new) in enumerate(zip(self.content_chunk_sha256, d.chunk_sha256))
+                if old != new
+            ]
+            where = _describe_chunks(bad, self.content_chunk_size, self.content_length)
+            return f'content SHA256 changed in bytes {where}'
+
+        if d.blake2b is not None and d.blake2b != self.content_blake2b:
+            return 'content BLAKE2b changed'
 
-        This function prints things to stdout.
+        return None
+
+    def _verify_chunk_sample(self, session, url, n_chunks, run_date=None):
+        """Verify a sample of chunks using HTTP Range requests.
+
+        The chunks are chosen pseudo-randomly from a hash of the domain, the
+        path, and *run_date*, which defaults to the current UTC date, so a
+        recorded run can be replayed with the same requests.
+
+        Returns ``(problem, n_bytes)``, where *problem* is None if all is well
+        or a string describing the problem, and *n_bytes* is the number of
+        bytes of content that were fetched. If the server doesn't honor range
+        requests, the full content is verified instead.
 
         """
-        url = self.url()
-        print(url, '... ', end='')
+        import datetime
+        import hashlib
+        import random
 
-        def err(text):
-            sys.stdout.flush()
-            # make it red!
-            sys.stdout.buffer.write(b'\x1b[1;31merror: ' + text.encode('utf-8') + b'\x1b[0m')
+        if run_date is None:
+            run_date = datetime.datetime.utcnow().date()
 
-        try:
-            resp = session.get(url, stream=True, allow_redirects=False)
+        rng = random.Random(f'{self._domain._domain}\0{self.path}\0{run_date.isoformat()}')
+        total = len(self.content_chunk_sha256)
+        bad = []
+        n_bytes = 0
+
+        for i in sorted(rng.sample(range(total), min(n_chunks, total))):
+            start = i * self.content_chunk_size
+            end = min(start + self.content_chunk_size, self.content_length) - 1
+            headers = {'Range': f'bytes={start}-{end}'}
+
+            with session.get(url, headers=headers, stream=True, allow_redirects=False) as resp:
+                if resp.status_code == 200:
+                    return (self._verify_content(resp), self.content_length)
+
+                if resp.status_code != 206:
+                    return (f'HTTP {resp.status_code} for range request', n_bytes)
+
+                data = resp.content
+                n_bytes += len(data)
+
+            if len(data) != end + 1 - start or hashlib.sha256(data).digest() != self.content_chunk_sha256[i]:
+                bad.append(i)
+
+        if bad:
+            where = _describe_chunks(bad, self.content_chunk_size, self.content_length)
+            return (f'content changed in bytes {where}', n_bytes)
+
+        return (None, n_bytes)
+
+    def _check(self, session, content=True, redirects=None, chunk_sample=None, fast_digest=False,
+               header_check=False, run_date=None):
+        """Check this URL without printing anything.
+
+        Returns ``(problem, notes, content_verified, content_bytes)``, where
+        *problem* is None if the URL is OK or a string describing what's
+        wrong, *notes* is a list of strings describing ignored discrepancies,
+        *content_verified* indicates whether the content was verified, and
+        *content_bytes* is the number of bytes of content that were fetched
+        to do so. Network errors are raised as exceptions.
+
+        """
+        url = self.url()
+        notes = []
+
+        with session.get(url, stream=True, allow_redirects=False) as resp:
             if not resp.ok:
-                err(f'HTTP {resp.status_code}')
-                return True
+                return (f'HTTP {resp.status_code}', notes, False, 0)
 
             if resp.is_redirect:
                 if 'redirect-ok' in self.categories:
@@ -161,43 +487,146 @@ class Record(object):
                     redir_content_type = f'X-{resp.status_code}-Redirect'
 
                     if redir_content_type != self.content_type:
-                        err(f'expected {self.content_type}; got {redir_content_type}')
-                        return True
+                        return (f'expected {self.content_type}; got {redir_content_type}', notes, False, 0)
+
+                    target = parse.urljoin(url, resp.headers['location'])
+
+                    if self.redirect_target is not None:
+                        expected = self._mapped_redirect_target()
+
+                        if target != expected:
+                            return (f'expected redirect to {expected}; got {target}', notes, False, 0)
+
+                    if redirects is not None:
+                        problem = redirects.resolve(session, target)
+                        if problem is not None:
+                            return (f'redirect target {target}: {problem}', notes, False, 0)
+
+                return (None, notes, False, 0)
+
+            content_type = resp.headers['content-type'].split(';')[0]  # ignore `; charset=utf-8`
+
+            if 'content-type-change-ok' in self.categories:
+                pass  # e.g. for webserviceproxy.aspx, which used to return app/xml for everything
+            elif content_type != self.content_type:
+                if self.content_type == 'application/javascript' and content_type == 'application/x-javascript':
+                    notes.append('ignoring JS content-type nit')
+                elif self.content_type == 'application/x-zip-compressed' and content_type == 'application/zip':
+                    notes.append('ignoring Zip content-type nit')
+                else:
+                    return (f'expected content-type {self.content_type}; got {content_type}', notes, False, 0)
+
+            if self.content_length is None:
+                return (None, notes, False, 0)
+
+            if not content:
+                # Content-Length doesn't describe the decoded body if the
+                # server compressed it, so we can only use it if it didn't.
+                length = resp.headers.get('content-length')
+
+                if header_check and length is not None and 'content-encoding' not in resp.headers:
+                    if int(length) != self.content_length:
+                        problem = f'Content-Length header changed from {self.content_length} to {length}'
+                        return (problem, notes, False, 0)
+
+                return (None, notes, False, 0)
+
+            if chunk_sample and self.content_chunk_size is not None:
+                resp.close()
+                problem, n_bytes = self._verify_chunk_sample(session, url, chunk_sample, run_date=run_date)
             else:
-                content_type = resp.headers['content-type'].split(';')[0]  # ignore `; charset=utf-8`
+                problem = self._verify_content(resp, fast_digest=fast_digest)
+                n_bytes = self.content_length
+
+            return (problem, notes, True, n_bytes)
+
+    def check(self, session, content=True, redirects=None, chunk_sample=None, fast_digest=False,
+              header_check=False, run_date=None):
+        """Check this URL!
+
+        Returns True if the URL had a problem, False if it's OK.
+
+        If *content* is true and this is a static record, its content is
+        verified. If *chunk_sample* is a positive integer and the record has
+        chunk digests, only that many chunks are verified, using HTTP Range
+        requests. The chunks are chosen pseudo-randomly, but the choice is
+        fixed for a given record and *run_date*, a :class:`datetime.date`
+        defaulting to today (UTC), so that recorded checks can be replayed. If
+        *fast_digest* is true and the record has a BLAKE2b digest, only that
+        digest is verified, skipping the slower SHA256 computation; it's good
+        for routine checks, while full audits should leave it false. If
+        *content* is false but *header_check* is true, the content length of a
+        static record is compared to the ``Content-Length`` header of the
+        response, if any.
+
+        If *redirects* is a :class:`RedirectCache`, the targets of redirects
+        are fetched too, and it's an error if they don't resolve. The cache
+        is meant to be shared among all of the checks in a run.
+
+        This function prints things to stdout. To check many records without
+        printing, use :meth:`Database.check_records`.
+
+        """
+        from .checking import check_record, print_result
+
+        result = check_record(
+            self,
+            session,
+            content = content,
+            redirects = redirects,
+            chunk_sample = chunk_sample,
+            fast_digest = fast_digest,
+            header_check = header_check,
+            run_date = run_date,
+            catch = False,
+        )
+        print_result(result)
+        return result.problem is not None
+
+
+class RedirectCache(object):
+    """Remember the outcomes of fetching redirect targets.
+
+    Many records can redirect to the same destination (e.g., a site's front
+    page), so when checking them we only want to fetch each target once. This
+    object is thread-safe.
 
-                if 'content-type-change-ok' in self.categories:
-                    pass  # e.g. for webserviceproxy.aspx, which used to return app/xml for everything
-                elif content_type != self.content_type:
-                    if self.content_type == 'application/javascript' and content_type == 'application/x-javascript':
-                        print('(ignoring JS content-type nit) ', end='')
-                    elif self.content_type == 'application/x-zip-compressed' and content_type == 'application/zip':
-                        print('(ignoring Zip content-type nit) ', end='')
-                    else:
-                        err(f'expected content-type {self.content_type}; got {content_type}')
-                        return True
+    """
+    def __init__(self):
+        import threading
 
-                if content and self.content_length is not None:
-                    d = hashlib.sha256()
-                    count = 0
+        self._results = {}
+        self._lock = threading.Lock()
 
-                    for chunk in resp.iter_content(chunk_size=None):
-                        d.update(chunk)
-                        count += len(chunk)
+    def resolve(self, session, url):
+        """Fetch *url*, following any further redirects.
 
-                    if count != self.content_length:
-                        err(f'content length changed from {self.content_length} to {count}')
-                        return True
+        Returns None if it resolved successfully, or a string describing the
+        problem if not. Results are cached, so *url* is only fetched once.
+
+        """
+        with self._lock:
+            if url in self._results:
+                return self._results[url]
+
+        # Multiple threads might race to fetch the same URL. That's wasteful
+        # but harmless, and better than blocking everyone on one fetch.
+        try:
+            with session.get(url, stream=True) as resp:
+                if resp.ok:
+                    problem = None
+                else:
+                    problem = f'HTTP {resp.status_code}'
+        except Exception as e:
+            problem = str(e)
 
-                    if d.digest() != self.content_sha256:
-                        err(f'content SHA256 changed')
-                        return True
+        with self._lock:
+            self._results[url] = problem
 
-            print('ok', end='')
-        finally:
-            print()
+        return problem
 
-        return False
+    def __len__(self):
+        return len(self._results)
 
 
 class Domain(object):
@@ -206,17 +635,26 @@ class Domain(object):
     _metadata = None
     _path = None
 
-    def __init__(self, db, domain, path):
+    def __init__(self, db, domain, path, metadata=None):
+        """If *metadata* is provided, the domain file is not read, and need
+        not exist yet.
+
+        """
         self._db = db
         self._domain = domain
         self._path = path
 
+        if metadata is not None:
+            self._metadata = metadata
+            return
+
         # The first YAML doc is the metadata header.
         for doc in self._all_yaml_docs():
             self._metadata = doc
             break
 
     def _all_yaml_docs(self):
+        import yaml
         first = True
 
         with open(self._path, 'rt') as f:
@@ -247,6 +685,9 @@ class Domain(object):
         properly normalized.
 
         """
+        import tempfile
+        import yaml
+
         def all_dicts():
             yield self._metadata
 
@@ -260,25 +701,44 @@ class Domain(object):
             delete = False,
         )
 
-        with tf as f:
-            yaml.dump_all(all_dicts(),
-                stream = f,
-                explicit_start = True,
-                sort_keys = True,
-            )
-
-        os.rename(f.name, self._path)
+        try:
+            with tf as f:
+                yaml.dump_all(all_dicts(),
+                    stream = f,
+                    explicit_start = True,
+                    sort_keys = True,
+                )
+
+            # Temporary files are created private to the user; don't let that
+            # leak into the database.
+            try:
+                mode = os.stat(self._path).st_mode & 0o777
+            except FileNotFoundError:
+                umask = os.umask(0)
+                os.umask(umask)
+                mode = 0o666 & ~umask
+
+            os.chmod(f.name, mode)
+            os.replace(f.name, self._path)
+        except BaseException:
+            # Don't leave partial files lying around in the database.
+            try:
+                os.unlink(tf.name)
+            except FileNotFoundError:
+                pass
+            raise
 
     def insert_record(self, rec):
         """Rewrite the multi-YAML file including the new record *rec*.
 
         If there's an existing record associated with the same path, it will
-        be replaced.
+        be replaced. The file is locked while it is rewritten, so that
+        concurrent insertions don't clobber each other. To make several
+        changes at once, use :meth:`Database.transaction`.
 
         """
-        by_path = {irec.path: irec for irec in self.records()}
-        by_path[rec.path] = rec
-        self._rewrite(by_path[p] for p in sorted(by_path.keys()))
+        with self._db.transaction() as txn:
+            txn.insert(rec)
 
     def has_https(self):
         return self._metadata.get('https', False)
@@ -291,6 +751,7 @@ class Database(object):
     _dbdir = None
     _domains = None
     _domain_aliases = None
+    _case_sensitive = None
     _active_maps = None
 
     def __init__(self, dbdir=None):
@@ -310,7 +771,13 @@ class Database(object):
 
         self._domains = sorted(domains)  # => consistent ordering
 
+        # Domain metadata is cached here so that URL normalization doesn't
+        # need to reopen the domain files.
+        self._case_sensitive = {}
+
         for domain in self.domains():
+            self._case_sensitive[domain._domain] = domain.has_case_sensitive_paths()
+
             for cname in domain._metadata.get('cnames', ()):
                 self._domain_aliases[cname] = domain._domain
 
@@ -321,23 +788,35 @@ class Database(object):
         for dname in self._domains:
             yield self._get_domain(dname)
 
-    def get_records(self, category=None, domain=None, path_prefix=None):
+    def get_records(self, category=None, domain=None, path_prefix=None, processes=None):
         """Get a set of records.
 
         By default, this function generates all known records. The arguments
         can filter down the selection in various ways.
 
+        If *processes* is an integer greater than one, the domain files are
+        parsed in parallel in a pool of that many processes, using
+        :func:`wwt_url_database.loader.load_domains`. This is only worthwhile
+        when scanning a large database.
+
         """
         if domain is None:
-            domains = self.domains()
+            dnames = self._domains
         else:
             dname = self._domain_aliases.get(domain)
             if dname is None:
                 raise Exception(f'illegal domain name {domain!r}')
-            domains = [self._get_domain(dname)]
+            dnames = [dname]
+
+        # Don't open the domain files here if the workers will be parsing them.
+        if processes is not None and processes > 1:
+            from .loader import load_domains
+            loaded = load_domains(self, dnames, processes=processes)
+        else:
+            loaded = ((d, d.records()) for d in (self._get_domain(dname) for dname in dnames))
 
-        for domain in domains:
-            for record in domain.records():
+        for domain, records in loaded:
+            for record in records:
                 if category is not None and category not in record.categories:
                     continue
 
@@ -363,22 +842,47 @@ class Database(object):
         if dname is None:
             raise Exception(f'illegal domain name {info.netloc!r} for URL {url!r}')
 
-        # The main WWT web server, being IIS, is case-insensitive in its URL
-        # paths. We define the downcased path as the normal form. We do not
-        # currently normalize the query parts of the URL, which *might* be
-        # case-insensitive depending on how a given API is implemented.
-        normpath = info.path
-        domain = self._get_domain(dname)
+        normpath = _normalize_path(info.path, info.query, self._case_sensitive[dname])
+        return (dname, normpath)
 
-        if not domain.has_case_sensitive_paths():
-            normpath = normpath.lower()
+    def normalize_many(self, urls, cache_size=65536, strict=True):
+        """Normalize a sequence of URLs.
 
-        # Note that we discard the fragment (for now?).
-        normpath = parse.SplitResult('', '', normpath, info.query, '')
-        normpath = normpath.geturl()
-        normpath = url_normalize(normpath)
+        This is equivalent to calling :meth:`normalize` on each item of the
+        iterable *urls*, but is much faster for large batches: domain names
+        are resolved once per distinct network location, and results for
+        repeated paths are memoized in an LRU cache holding up to
+        *cache_size* entries. Results are generated lazily, in input order.
 
-        return (dname, normpath)
+        If *strict* is false, None is generated for URLs on unrecognized
+        domains rather than raising an exception.
+
+        """
+        import functools
+
+        netlocs = {}
+
+        @functools.lru_cache(maxsize=cache_size)
+        def normpath(path, query, case_sensitive):
+            return _normalize_path(path, query, case_sensitive)
+
+        for url in urls:
+            info = parse.urlsplit(url)
+
+            try:
+                dname, case_sensitive = netlocs[info.netloc]
+            except KeyError:
+                dname = self._domain_aliases.get(info.netloc)
+                case_sensitive = self._case_sensitive.get(dname)
+                netlocs[info.netloc] = (dname, case_sensitive)
+
+            if dname is None:
+                if strict:
+                    raise Exception(f'illegal domain name {info.netloc!r} for URL {url!r}')
+                yield None
+                continue
+
+            yield (dname, normpath(info.path, info.query, case_sensitive))
 
     def get_record(self, url):
         """Obtain a preexisting record for a given URL.
@@ -402,6 +906,77 @@ class Database(object):
         })
         return (domain, rec, False)
 
+    def snapshot(self, processes=None):
+        """Load an immutable view of the database that's safe to share
+        between threads.
+
+        Returns a :class:`wwt_url_database.snapshot.Snapshot`. Maps
+        activated with :meth:`activate_map` aren't included. *processes* is
+        as for :meth:`get_records`.
+
+        """
+        from .snapshot import Snapshot
+        return Snapshot(self, processes=processes)
+
+    def transaction(self):
+        """Stage a batch of changes to the database.
+
+        Returns a context manager yielding a
+        :class:`wwt_url_database.transaction.Transaction`. The changes are
+        committed when the ``with`` block exits normally, and discarded if it
+        raises an exception. Example::
+
+          with db.transaction() as txn:
+              txn.add_categories('http://example.com/', 'frontend')
+              txn.delete('http://example.com/old')
+
+        """
+        import contextlib
+        from .transaction import Transaction
+
+        @contextlib.contextmanager
+        def manager():
+            txn = Transaction(self)
+            yield txn
+            txn.commit()
+
+        return manager()
+
+    def check_records(self, records, session, **kwargs):
+        """Check many records concurrently, generating structured results.
+
+        If *records* is None, all records are checked. *session* is a
+        `requests` session, which should have a connection pool large enough
+        for the concurrency. Generates
+        :class:`wwt_url_database.checking.CheckResult` tuples as the checks
+        finish; nothing is printed. Keyword arguments are passed to
+        :func:`wwt_url_database.checking.check_records`, which see.
+
+        """
+        from .checking import check_records
+
+        if records is None:
+            records = self.get_records()
+
+        return check_records(records, session, **kwargs)
+
+    def acheck_records(self, records, session, **kwargs):
+        """An asynchronous generator version of :meth:`check_records`.
+
+        Example::
+
+          async for result in db.acheck_records(None, session, concurrency=16):
+              if result.problem is not None:
+                  ...
+
+        """
+        from .checking import acheck_records
+
+        if records is None:
+            records = self.get_records()
+
+        return acheck_records(records, session, **kwargs)
+
     def activate_map(self, original, alias):
         """When fetching URLs, map *original* to *alias*
 
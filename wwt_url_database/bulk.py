@@ -0,0 +1,175 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2020 the .NET Foundation
+# Distributed under the terms of the revised (3-clause) BSD license.
+
+"""Bulk export and import of the entire database.
+
+The database is serialized as a stream of items, each a dict. For each
+domain, a domain item comes first::
+
+  {"_type": "domain", "domain": "example.com", "metadata": {...}}
+
+followed by one record item per record, with the record in the same dict form
+used in the YAML files::
+
+  {"_type": "record", "domain": "example.com", "record": {"_path": "/", ...}}
+
+Every record is included, even deprecated ones. The stream can be encoded as
+JSON Lines, one item per line, or as a sequence of concatenated msgpack
+objects. The latter requires the optional `msgpack` package.
+
+"""
+import contextlib
+import json
+import os.path
+import re
+
+from . import Domain, Record
+
+__all__ = '''
+FORMATS
+guess_format
+import_items
+iter_items
+read_items
+write_items
+'''.split()
+
+
+FORMATS = ('jsonl', 'msgpack')
+
+# Domain names become file names, so only accept plain host names.
+_DOMAIN_NAME_RE = re.compile(r'[a-z0-9]([a-z0-9-]*[a-z0-9])?(\.[a-z0-9]([a-z0-9-]*[a-z0-9])?)*', re.IGNORECASE)
+
+_EXTENSIONS = {
+    '.jsonl': 'jsonl',
+    '.json': 'jsonl',
+    '.msgpack': 'msgpack',
+    '.mpk': 'msgpack',
+}
+
+
+def guess_format(path):
+    """Guess the bulk format from a file name, defaulting to JSON Lines."""
+    return _EXTENSIONS.get(os.path.splitext(path)[1].lower(), 'jsonl')
+
+
+def iter_items(db):
+    """Generate the items of the bulk serialization of *db*."""
+
+    for domain in db.domains():
+        dname = domain._domain
+        yield {'_type': 'domain', 'domain': dname, 'metadata': domain._metadata}
+
+        for rec in domain.records():
+            yield {'_type': 'record', 'domain': dname, 'record': rec.as_dict()}
+
+
+def _import_msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        raise Exception('the "msgpack" format requires the "msgpack" Python package')
+    return msgpack
+
+
+def write_items(items, f, format='jsonl'):
+    """Serialize *items* to the binary stream *f*."""
+
+    if format == 'jsonl':
+        for item in items:
+            f.write(json.dumps(item, sort_keys=True).encode('utf-8'))
+            f.write(b'\n')
+    elif format == 'msgpack':
+        packer = _import_msgpack().Packer()
+
+        for item in items:
+            f.write(packer.pack(item))
+    else:
+        raise ValueError(f'unknown bulk format {format!r}')
+
+
+def read_items(f, format='jsonl'):
+    """Generate items deserialized from the binary stream *f*."""
+
+    if format == 'jsonl':
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line.decode('utf-8'))
+    elif format == 'msgpack':
+        yield from _import_msgpack().Unpacker(f, raw=False)
+    else:
+        raise ValueError(f'unknown bulk format {format!r}')
+
+
+def import_items(db, items):
+    """Rewrite the domain files of *db* from bulk *items*.
+
+    Each domain in the stream has its file regenerated in canonical form,
+    creating it if necessary. Domain files not mentioned in the stream are
+    left alone. The whole stream is validated before any file is written,
+    and the files are locked while they're rewritten, as in
+    :meth:`Database.transaction`. Returns a dict mapping domain names to the
+    number of records written.
+
+    """
+    metadata = {}
+    records = {}
+
+    for item in items:
+        itype = item.get('_type')
+        dname = item.get('domain')
+
+        if itype == 'domain':
+            if not isinstance(dname, str) or not _DOMAIN_NAME_RE.fullmatch(dname):
+                raise Exception(f'illegal domain name {dname!r} in the import')
+            if dname in metadata:
+                raise Exception(f'domain {dname!r} appears more than once in the import')
+            metadata[dname] = item.get('metadata') or {}
+            records[dname] = {}
+        elif itype == 'record':
+            by_path = records.get(dname)
+            if by_path is None:
+                raise Exception(f'record for domain {dname!r} precedes the domain metadata')
+
+            rdict = item['record']
+            path = rdict['_path']
+            if path in by_path:
+                raise Exception(f'duplicate record for {dname}{path} in the import')
+            by_path[path] = rdict
+        else:
+            raise Exception(f'unexpected item type {itype!r} in the import')
+
+    # Build every record before writing anything, so that a malformed
+    # import doesn't leave the database half-rewritten.
+    rewrites = []
+
+    for dname, meta in metadata.items():
+        domain = Domain(db, dname, os.path.join(db._dbdir, dname + '.yaml'), metadata=meta)
+        recs = []
+
+        for path in sorted(records[dname].keys()):
+            try:
+                recs.append(Record(domain, dict(records[dname][path])))
+            except Exception as e:
+                raise Exception(f'invalid record for {dname}{path} in the import: {e!r}')
+
+        rewrites.append((domain, recs))
+
+    # Take the same locks as transactions, in the same order, so that
+    # concurrent writers don't lose each other's changes.
+    from .transaction import locked_domain
+
+    rewrites.sort(key=lambda item: item[0]._domain)
+    counts = {}
+
+    with contextlib.ExitStack() as stack:
+        for domain, _recs in rewrites:
+            stack.enter_context(locked_domain(db, domain._domain))
+
+        for domain, recs in rewrites:
+            domain._rewrite(recs)
+            counts[domain._domain] = len(recs)
+
+    return counts
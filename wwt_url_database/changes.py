@@ -0,0 +1,132 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2020 the .NET Foundation
+# Distributed under the terms of the revised (3-clause) BSD license.
+
+"""Identify records that have changed relative to an earlier database state.
+
+An earlier state is represented as a dict mapping domain names to dicts that
+map record paths to their YAML documents. It can be loaded from a git
+revision of the database directory, from a snapshot directory containing
+copies of the domain files, or from a snapshot file created by ``wwturldb
+export``.
+
+"""
+import os.path
+import subprocess
+
+from . import Record
+
+__all__ = '''
+changed_records
+load_git_revision
+load_snapshot
+load_snapshot_dir
+'''.split()
+
+
+def _docs_by_path(text):
+    import yaml
+
+    by_path = {}
+    first = True
+
+    for doc in yaml.safe_load_all(text):
+        if first:
+            first = False  # skip the metadata header
+            continue
+
+        if doc is not None:
+            by_path[doc['_path']] = doc
+
+    return by_path
+
+
+def _git(dbdir, *args):
+    try:
+        return subprocess.check_output(
+            ['git', '-C', dbdir] + list(args),
+            stderr = subprocess.PIPE,
+        ).decode('utf-8')
+    except subprocess.CalledProcessError as e:
+        msg = e.stderr.decode('utf-8', errors='replace').strip()
+        raise Exception(f'git {args[0]} failed: {msg}')
+
+
+def load_git_revision(db, rev):
+    """Load the state of the domain files in *db* as of the git revision *rev*.
+
+    Domain files that did not exist at that revision are absent from the
+    result.
+
+    """
+    _git(db._dbdir, 'rev-parse', '--verify', rev + '^{commit}')
+    names = _git(db._dbdir, 'ls-tree', '--name-only', rev, './').splitlines()
+    state = {}
+
+    for name in names:
+        if not name.endswith('.yaml'):
+            continue
+
+        text = _git(db._dbdir, 'show', f'{rev}:./{name}')
+        state[name[:-5]] = _docs_by_path(text)
+
+    return state
+
+
+def load_snapshot_dir(path):
+    """Load an earlier database state from a directory of domain files."""
+
+    state = {}
+
+    for entry in os.listdir(path):
+        if entry.endswith('.yaml'):
+            with open(os.path.join(path, entry), 'rt') as f:
+                state[entry[:-5]] = _docs_by_path(f)
+
+    return state
+
+
+def load_snapshot(path):
+    """Load an earlier database state from a snapshot.
+
+    *path* may be a directory of domain files, or a bulk export file as
+    written by :func:`wwt_url_database.bulk.write_items`.
+
+    """
+    if os.path.isdir(path):
+        return load_snapshot_dir(path)
+
+    from .bulk import guess_format, read_items
+
+    state = {}
+
+    with open(path, 'rb') as f:
+        for item in read_items(f, guess_format(path)):
+            if item['_type'] == 'domain':
+                state.setdefault(item['domain'], {})
+            elif item['_type'] == 'record':
+                state.setdefault(item['domain'], {})[item['record']['_path']] = item['record']
+
+    return state
+
+
+def changed_records(db, old_state, **kwargs):
+    """Generate records in *db* that are new or modified relative to *old_state*.
+
+    Keyword arguments are passed to :meth:`Database.get_records` to filter the
+    records considered. Records are compared in their canonical dict form, so
+    mere reformatting of a domain file doesn't count as a change.
+
+    """
+    for rec in db.get_records(**kwargs):
+        old_doc = old_state.get(rec._domain._domain, {}).get(rec.path)
+
+        if old_doc is None:
+            yield rec
+            continue
+
+        # Round-trip through Record to canonicalize.
+        old_dict = Record(rec._domain, dict(old_doc)).as_dict()
+
+        if old_dict != rec.as_dict():
+            yield rec
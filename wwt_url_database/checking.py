@@ -0,0 +1,254 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2020 the .NET Foundation
+# Distributed under the terms of the revised (3-clause) BSD license.
+
+"""Check many records concurrently, without printing anything.
+
+:func:`check_records` runs :meth:`Record.check`-style checks in a pool of
+threads and generates :class:`CheckResult` tuples as the checks finish.
+:func:`acheck_records` does the same as an asynchronous generator, for use in
+:mod:`asyncio` applications. Both accept optional callbacks that are invoked
+for each result and to report progress. Usually you'll reach these through
+:meth:`Database.check_records` and :meth:`Database.acheck_records`.
+
+"""
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import sys
+import time
+
+__all__ = '''
+CheckResult
+acheck_records
+check_record
+check_records
+print_result
+'''.split()
+
+
+CheckResult = namedtuple('CheckResult', 'record url problem notes content_verified content_bytes elapsed')
+CheckResult.__doc__ = '''The outcome of checking one record. *problem* is None
+if the URL is OK, or a string describing what's wrong. *notes* is a tuple of
+strings describing discrepancies that were ignored. *content_verified* is true
+if the content of the record was verified, and *content_bytes* is the number
+of bytes of content fetched to do so, which is less than the content length
+if only a sample of chunks was verified. *elapsed* is the wall-clock time
+taken by the check, in seconds.'''
+
+
+def check_record(rec, session, content=True, redirects=None, chunk_sample=None, fast_digest=False,
+                 header_check=False, run_date=None, catch=True):
+    """Check one record, returning a :class:`CheckResult`.
+
+    The arguments are as for :meth:`Record.check`. If *catch* is true,
+    exceptions raised while checking, such as network errors, are reported
+    as problems in the result; otherwise they propagate.
+
+    """
+    url = rec.url()
+    t0 = time.monotonic()
+
+    try:
+        problem, notes, verified, n_bytes = rec._check(
+            session,
+            content = content,
+            redirects = redirects,
+            chunk_sample = chunk_sample,
+            fast_digest = fast_digest,
+            header_check = header_check,
+            run_date = run_date,
+        )
+    except Exception as e:
+        if not catch:
+            raise
+        problem, notes, verified, n_bytes = (str(e) or e.__class__.__name__, (), False, 0)
+
+    return CheckResult(rec, url, problem, tuple(notes), verified, n_bytes, time.monotonic() - t0)
+
+
+def print_result(result):
+    """Print a :class:`CheckResult` to stdout in the style of the CLI."""
+
+    print(result.url, '... ', end='')
+
+    for note in result.notes:
+        print(f'({note}) ', end='')
+
+    if result.problem is None:
+        print('ok')
+    else:
+        sys.stdout.flush()
+        # make it red!
+        sys.stdout.buffer.write(b'\x1b[1;31merror: ' + result.problem.encode('utf-8') + b'\x1b[0m')
+        print()
+
+
+def _make_job(session, content, redirects, chunk_sample, fast_digest, header_check, run_date):
+    if callable(content):
+        want_content = content
+    else:
+        want_content = lambda rec: content
+
+    def job(rec):
+        return check_record(
+            rec,
+            session,
+            content = want_content(rec),
+            redirects = redirects,
+            chunk_sample = chunk_sample,
+            fast_digest = fast_digest,
+            header_check = header_check,
+            run_date = run_date,
+        )
+
+    return job
+
+
+def _total(records):
+    try:
+        return len(records)
+    except TypeError:
+        return None
+
+
+def check_records(
+    records,
+    session,
+    concurrency = 8,
+    content = True,
+    redirects = None,
+    chunk_sample = None,
+    fast_digest = False,
+    header_check = False,
+    run_date = None,
+    callback = None,
+    progress = None,
+):
+    """Check *records*, generating :class:`CheckResult` tuples as they finish.
+
+    Up to *concurrency* checks run at once in a pool of threads, and only a
+    bounded number of records are taken from *records* ahead of the results
+    being consumed, so it may be a lazy iterable. Results are generated in
+    order of completion, which need not match the order of *records*.
+
+    *content* may be a boolean, or a callable that takes a record and returns
+    whether its content should be verified. *redirects*, *chunk_sample*,
+    *fast_digest*, *header_check* and *run_date* are as for
+    :meth:`Record.check`. Problems, including network errors, are reported in
+    the results rather than raised.
+
+    If *callback* is given, it is called with each result before it is
+    generated. If *progress* is given, it is called with ``(done, total)``
+    after each result, where *total* is None if *records* has no length.
+    Both are called in the thread consuming the results.
+
+    """
+    job = _make_job(session, content, redirects, chunk_sample, fast_digest, header_check, run_date)
+    total = _total(records)
+    records = iter(records)
+    done = 0
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = set()
+
+        def refill():
+            for rec in records:
+                pending.add(pool.submit(job, rec))
+                if len(pending) >= 2 * concurrency:
+                    break
+
+        refill()
+
+        while pending:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            refill()
+
+            for future in finished:
+                result = future.result()
+                done += 1
+
+                if callback is not None:
+                    callback(result)
+                if progress is not None:
+                    progress(done, total)
+
+                yield result
+
+
+async def acheck_records(
+    records,
+    session,
+    concurrency = 8,
+    content = True,
+    redirects = None,
+    chunk_sample = None,
+    fast_digest = False,
+    header_check = False,
+    run_date = None,
+    callback = None,
+    progress = None,
+):
+    """Check *records*, asynchronously generating :class:`CheckResult` tuples.
+
+    This is an asynchronous generator version of :func:`check_records`, with
+    the same arguments. The checks themselves still run in a pool of threads,
+    and *records* is iterated in another thread, so that neither blocks the
+    event loop. Callbacks are called in the event loop thread. If the
+    consumer stops early, checks that haven't started are cancelled, and
+    those in progress finish in the background.
+
+    """
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    job = _make_job(session, content, redirects, chunk_sample, fast_digest, header_check, run_date)
+    total = _total(records)
+    records = iter(records)
+    end = object()
+    exhausted = False
+    done = 0
+
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    # *records* may be a generator that parses domain files, so pull from it
+    # in a thread too. A generator can't run in two threads at once, so just
+    # one.
+    feeder = ThreadPoolExecutor(max_workers=1)
+    pending = set()
+
+    async def refill():
+        nonlocal exhausted
+
+        while not exhausted and len(pending) < 2 * concurrency:
+            rec = await loop.run_in_executor(feeder, next, records, end)
+
+            if rec is end:
+                exhausted = True
+            else:
+                pending.add(loop.run_in_executor(pool, job, rec))
+
+    try:
+        await refill()
+
+        while pending:
+            finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            await refill()
+
+            for future in finished:
+                result = future.result()
+                done += 1
+
+                if callback is not None:
+                    callback(result)
+                if progress is not None:
+                    progress(done, total)
+
+                yield result
+    finally:
+        # If the consumer stops early, don't block the event loop waiting for
+        # checks that nobody wants; cancel the queued ones and let the running
+        # ones finish in the background.
+        for future in pending:
+            future.cancel()
+
+        pool.shutdown(wait=False)
+        feeder.shutdown(wait=False)
@@ -4,12 +4,14 @@
 
 """Entrypoint for the command-line interface.
 
+Subcommands import network libraries such as `requests` locally, so that
+commands like ``dump-urls`` that never touch the network start up quickly.
+
 """
 import argparse
-import requests
 import sys
 
-from . import Database
+from . import Database, RedirectCache
 
 
 def die(msg):
@@ -35,6 +37,64 @@ def add_record_filter_args(parser):
         metavar = 'PREFIX',
         help = 'Only consider paths starting with the specified prefix',
     )
+    parser.add_argument(
+        '--load-processes',
+        metavar = 'N',
+        type = int,
+        help = 'Parse the database files in parallel using N processes',
+    )
+
+def add_map_arg(parser):
+    parser.add_argument(
+        '--map',
+        action = 'append',
+        metavar = 'ORIGINAL=ALIAS',
+        help = 'Rewrite requests for the domain ORIGINAL to point to ALIAS instead',
+    )
+
+def activate_maps(db, settings):
+    "Activate the domain maps specified with --map."
+    for mapspec in (settings.map or []):
+        pieces = mapspec.split('=', 1)
+        if len(pieces) != 2:
+            die(f'invalid "--map" specification {mapspec!r}: should contain one equals sign')
+
+        original, alias = pieces
+
+        if original not in db._domains:
+            die(f'invalid "--map" specification {mapspec!r}: original domain name {original} not recognized')
+
+        db.activate_map(original, alias)
+
+def add_chunk_size_arg(parser):
+    parser.add_argument(
+        '--chunk-size',
+        metavar = 'SIZE',
+        help = 'Also record digests of each SIZE-byte chunk of static content (e.g. "4M")',
+    )
+
+def add_blake2b_arg(parser):
+    parser.add_argument(
+        '--blake2b',
+        action = 'store_true',
+        help = 'Also record a BLAKE2b digest of static content, for cheaper "check --fast-digest" runs',
+    )
+
+def get_chunk_size(settings):
+    if settings.chunk_size is None:
+        return None
+
+    from .planning import parse_size
+
+    try:
+        size = parse_size(settings.chunk_size)
+    except ValueError as e:
+        die(f'invalid "--chunk-size" {settings.chunk_size!r}: {e}')
+
+    if size < 1:
+        die('"--chunk-size" must be positive')
+
+    return size
 
 def get_records_with_filtering(db, settings):
     "Return a generator of records applying the user's specified filters."
@@ -42,6 +102,7 @@ def get_records_with_filtering(db, settings):
         category = settings.category,
         domain = settings.domain,
         path_prefix = settings.path_prefix,
+        processes = settings.load_processes,
     )
 
 
@@ -53,6 +114,8 @@ def add_getparser(parser):
         action = 'store_true',
         help = 'Indicate that this URL should return static, unchanging content',
     )
+    add_chunk_size_arg(parser)
+    add_blake2b_arg(parser)
     parser.add_argument(
         '-c', '--category',
         action = 'append',
@@ -79,57 +142,691 @@ def add_impl(settings):
         warn(f'URL {settings.url} already registered; doing nothing')
         return
 
+    import requests
     session = requests.session()
-    record.initialize(session, static=settings.static)
+    record.initialize(
+        session,
+        static = settings.static,
+        chunk_size = get_chunk_size(settings),
+        blake2b = settings.blake2b,
+    )
 
     for cat in settings.category or []:
         record.categories.add(cat)
 
-    domain.insert_record(record)
+    from .transaction import TransactionError
+
+    try:
+        with db.transaction() as txn:
+            txn.insert(record, replace=False)
+    except TransactionError:
+        # Someone else registered it while we were fetching.
+        warn(f'URL {settings.url} already registered; doing nothing')
+
+
+# "add-from-wtml" subcommand
+
+def add_from_wtml_getparser(parser):
+    parser.add_argument(
+        '--static',
+        action = 'store_true',
+        help = 'Indicate that the new URLs should return static, unchanging content',
+    )
+    add_chunk_size_arg(parser)
+    add_blake2b_arg(parser)
+    parser.add_argument(
+        '-c', '--category',
+        action = 'append',
+        metavar = 'CATEGORY',
+        help = 'Mark the new URLs as belonging to the specified CATEGORY',
+    )
+    parser.add_argument(
+        '--concurrency', '-j',
+        metavar = 'N',
+        type = int,
+        default = 8,
+        help = 'Make at most N simultaneous requests (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--dry-run', '-n',
+        action = 'store_true',
+        help = 'Report the new URLs but do not fetch them or modify the database',
+    )
+    parser.add_argument(
+        'sources',
+        nargs = '+',
+        metavar = 'WTML',
+        help = 'WTML files to scan, as local paths or HTTP(S) URLs',
+    )
+
+def add_from_wtml_impl(settings):
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    from . import Record
+    from .net import make_session
+    from .transaction import TransactionError
+    from .wtml import extract_urls
+
+    db = Database()
+    session = make_session(pool_size=settings.concurrency)
+    chunk_size = get_chunk_size(settings)
+
+    # Collect the normalized URLs on known domains.
+
+    def all_urls():
+        for source in settings.sources:
+            try:
+                if source.startswith(('http://', 'https://')):
+                    with session.get(source, stream=True) as resp:
+                        resp.raise_for_status()
+                        resp.raw.decode_content = True
+                        yield from extract_urls(resp.raw)
+                else:
+                    yield from extract_urls(source)
+            except Exception as e:
+                die(f'cannot read WTML from {source!r}: {e}')
+
+    wanted = {}  # dname => set of paths
+    n_refs = 0
+
+    for key in db.normalize_many(all_urls(), strict=False):
+        n_refs += 1
+        if key is not None:
+            wanted.setdefault(key[0], set()).add(key[1])
+
+    # Skip the ones that are already registered, reading each domain once.
+
+    new = []
+
+    for dname, paths in sorted(wanted.items()):
+        domain = db._get_domain(dname)
+        paths = paths - set(rec.path for rec in domain.records())
+
+        for path in sorted(paths):
+            new.append(Record(domain, {'_path': path, 'content-type': 'UNKNOWN'}))
+
+    n_wanted = sum(len(p) for p in wanted.values())
+    print(f'{n_refs} URL references; {n_wanted} distinct URLs on known domains; {len(new)} new')
+
+    if settings.dry_run:
+        for rec in new:
+            print('   ', rec.url(mapped=False))
+        return
+
+    # Initialize the new records concurrently.
+
+    def work(rec):
+        rec.initialize(session, static=settings.static, chunk_size=chunk_size, blake2b=settings.blake2b)
+
+    added = []
+    n_errors = 0
+
+    with ThreadPoolExecutor(max_workers=settings.concurrency) as pool:
+        futures = {pool.submit(work, rec): rec for rec in new}
+
+        for fut in as_completed(futures):
+            rec = futures[fut]
+
+            try:
+                fut.result()
+            except Exception as e:
+                warn(f'failed to initialize {rec.url()}: {e}')
+                n_errors += 1
+                continue
+
+            rec.categories.update(settings.category or ())
+            added.append(rec)
+            print(rec.url(), rec.content_type)
+
+    try:
+        with db.transaction() as txn:
+            for rec in added:
+                txn.insert(rec, replace=False)
+    except TransactionError as e:
+        die(f'{e}; someone else modified the database while we were working, so nothing was saved')
+
+    print()
+    print(f'added {len(added)} records')
+
+    if n_errors:
+        die(f'failed to add {n_errors} URLs')
 
 
 # "check" subcommand
 
 def check_getparser(parser):
+    add_map_arg(parser)
     parser.add_argument(
-        '--map',
+        '--concurrency', '-j',
+        metavar = 'N',
+        type = int,
+        default = 8,
+        help = 'Check at most N URLs simultaneously (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--changed-since',
+        metavar = 'REV',
+        help = 'Only check records that are new or modified since git revision REV',
+    )
+    parser.add_argument(
+        '--changed-since-snapshot',
+        metavar = 'PATH',
+        help = 'Only check records that are new or modified relative to PATH, a directory of '
+            'domain files or a file created by "export"',
+    )
+    parser.add_argument(
+        '--verify-redirects',
+        action = 'store_true',
+        help = 'Also check that the targets of redirects resolve successfully',
+    )
+    parser.add_argument(
+        '--dedupe-mirrors',
+        action = 'store_true',
+        help = 'Verify the content of only one of each set of static records with identical digests, '
+            'and check the Content-Length headers of the rest',
+    )
+    parser.add_argument(
+        '--content-sample',
+        metavar = 'K/N',
+        help = 'Only verify the content of a rotating K/N subset of static records in this run',
+    )
+    parser.add_argument(
+        '--run-date',
+        metavar = 'YYYY-MM-DD',
+        help = 'Plan content verification and chunk sampling as if running on this date (default: today, UTC)',
+    )
+    parser.add_argument(
+        '--max-bytes',
+        metavar = 'SIZE',
+        help = 'Download at most about SIZE bytes (e.g. "500M") for content verification',
+    )
+    parser.add_argument(
+        '--priority-category',
         action = 'append',
-        metavar = 'ORIGINAL=ALIAS',
-        help = 'Rewrite requests for the domain ORIGINAL to point to ALIAS instead',
+        metavar = 'CATEGORY',
+        help = 'With "--max-bytes", verify records in CATEGORY before others',
+    )
+    parser.add_argument(
+        '--history',
+        metavar = 'PATH',
+        help = 'Read and update a JSON file recording when each record\'s content was last verified',
+    )
+    parser.add_argument(
+        '--timings',
+        metavar = 'PATH',
+        help = 'Read and update a JSON file recording how long each record took to check',
+    )
+    parser.add_argument(
+        '--longest-first',
+        action = 'store_true',
+        help = 'Start the checks expected to take longest first, based on content lengths and "--timings"',
+    )
+    parser.add_argument(
+        '--dns-ttl',
+        metavar = 'SECONDS',
+        type = float,
+        default = 300.,
+        help = 'Cache host name lookups for this long; 0 disables the cache (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--prewarm',
+        action = 'store_true',
+        help = 'Open connections to all of the hosts to be checked before starting the checks',
+    )
+    parser.add_argument(
+        '--chunk-sample',
+        metavar = 'N',
+        type = int,
+        help = 'For records with chunk digests, verify only N pseudo-random chunks using HTTP Range requests',
+    )
+    parser.add_argument(
+        '--fast-digest',
+        action = 'store_true',
+        help = 'Verify content using only the BLAKE2b digest, for records that have one',
+    )
+    parser.add_argument(
+        '--record',
+        metavar = 'DIR',
+        help = 'Save all HTTP responses into DIR for later use with "--replay"; bodies are only saved '
+            'as far as this run reads them',
+    )
+    parser.add_argument(
+        '--replay',
+        metavar = 'DIR',
+        help = 'Serve HTTP responses from a recording in DIR instead of using the network',
     )
     add_record_filter_args(parser)
 
 def check_impl(settings):
-    session = requests.session()
+    from .checking import print_result
+    from .net import make_session
+
+    session = make_session(pool_size=settings.concurrency)
     db = Database()
     total = 0
     errors = 0
 
-    for mapspec in (settings.map or []):
-        pieces = mapspec.split('=', 1)
-        if len(pieces) != 2:
-            die(f'invalid "--map" specification {mapspec!r}: should contain one equals sign')
+    activate_maps(db, settings)
 
-        original, alias = pieces
+    if settings.record is not None and settings.replay is not None:
+        die('"--record" and "--replay" are mutually exclusive')
 
-        if original not in db._domains:
-            die(f'invalid "--map" specification {mapspec!r}: original domain name {original} not recognized')
+    if settings.chunk_sample is not None and settings.chunk_sample < 1:
+        die(f'"--chunk-sample" must be at least 1, not {settings.chunk_sample}')
 
-        db.activate_map(original, alias)
+    if settings.record is not None:
+        from .replay import install_recorder
+        install_recorder(session, settings.record, pool_size=settings.concurrency)
+    elif settings.replay is not None:
+        from .replay import install_replayer
 
-    for rec in get_records_with_filtering(db, settings):
+        try:
+            install_replayer(session, settings.replay)
+        except Exception as e:
+            die(str(e))
+
+    if settings.changed_since is not None and settings.changed_since_snapshot is not None:
+        die('"--changed-since" and "--changed-since-snapshot" are mutually exclusive')
+
+    if settings.changed_since is not None or settings.changed_since_snapshot is not None:
+        from .changes import changed_records, load_git_revision, load_snapshot
+
+        try:
+            if settings.changed_since is not None:
+                old_state = load_git_revision(db, settings.changed_since)
+            else:
+                old_state = load_snapshot(settings.changed_since_snapshot)
+        except Exception as e:
+            die(f'cannot load the earlier database state: {e}')
+
+        records = changed_records(
+            db,
+            old_state,
+            category = settings.category,
+            domain = settings.domain,
+            path_prefix = settings.path_prefix,
+            processes = settings.load_processes,
+        )
+    else:
+        records = get_records_with_filtering(db, settings)
+
+    redirects = None
+    if settings.verify_redirects:
+        redirects = RedirectCache()
+
+    # Plan which static records get full content verification.
+
+    import datetime
+    from . import planning
+
+    if settings.run_date is None:
+        run_date = datetime.datetime.utcnow().date()
+    else:
+        try:
+            run_date = datetime.date.fromisoformat(settings.run_date)
+        except ValueError as e:
+            die(f'invalid "--run-date" {settings.run_date!r}: {e}')
+
+    history = None
+    if settings.history is not None:
+        history = planning.load_history(settings.history)
+
+    records = list(records)
+    static = [r for r in records if r.content_length is not None]
+    to_verify = static
+    duplicates = []
+
+    if settings.dedupe_mirrors:
+        from .mirrors import ContentIndex
+        to_verify, duplicates = ContentIndex(static).split()
+
+    if settings.content_sample is not None:
+        try:
+            num, denom = planning.parse_fraction(settings.content_sample)
+        except ValueError as e:
+            die(f'invalid "--content-sample" {settings.content_sample!r}: {e}')
+
+        sampler = planning.ContentSampler(num, denom, run_date=run_date)
+        to_verify = [r for r in to_verify if sampler.selected(r)]
+
+    max_bytes = None
+    if settings.max_bytes is not None:
+        try:
+            max_bytes = planning.parse_size(settings.max_bytes)
+        except ValueError as e:
+            die(f'invalid "--max-bytes" {settings.max_bytes!r}: {e}')
+
+        to_verify, planned_bytes = planning.plan_content_budget(
+            to_verify,
+            max_bytes,
+            history = history,
+            priority_categories = settings.priority_category or (),
+        )
+
+    to_verify = set(id(r) for r in to_verify)
+    verified_bytes = 0
+
+    timings = None
+    if settings.timings is not None:
+        timings = planning.load_timings(settings.timings)
+
+    if settings.longest_first:
+        records = planning.order_longest_first(
+            records,
+            verify = lambda rec: id(rec) in to_verify,
+            timings = timings,
+        )
+
+    dns_cache = None
+    if settings.dns_ttl > 0:
+        from .net import DNSCache
+        dns_cache = DNSCache(ttl=settings.dns_ttl)
+        dns_cache.install()
+
+    if settings.prewarm:
+        import time
+        from .net import prewarm
+
+        urls = [rec.url() for rec in records]
+        if redirects is not None:
+            urls += [rec._mapped_redirect_target() for rec in records if rec.redirect_target is not None]
+
+        t0 = time.monotonic()
+        problems = prewarm(session, urls, connections=settings.concurrency)
+
+        for origin, problem in sorted(problems.items()):
+            if problem is not None:
+                warn(f'could not prewarm connections to {origin}: {problem}')
+
+        print(f'prewarmed connections to {len(problems)} hosts in {time.monotonic() - t0:.2f} s')
+        print()
+
+    for result in db.check_records(
+        records,
+        session,
+        concurrency = settings.concurrency,
+        content = lambda rec: id(rec) in to_verify,
+        redirects = redirects,
+        chunk_sample = settings.chunk_sample,
+        fast_digest = settings.fast_digest,
+        header_check = settings.dedupe_mirrors,
+        run_date = run_date,
+        callback = print_result,
+    ):
+        rec = result.record
         total += 1
-        if rec.check(session):
+
+        if timings is not None:
+            timings[planning.history_key(rec)] = {
+                'elapsed': round(result.elapsed, 4),
+                'bytes': result.content_bytes,
+            }
+
+        if result.problem is not None:
             errors += 1
+        elif result.content_verified:
+            verified_bytes += result.content_bytes
+
+            # A sample of chunks doesn't count as a full verification.
+            if history is not None and result.content_bytes == rec.content_length:
+                history[planning.history_key(rec)] = run_date.isoformat()
+
+    if dns_cache is not None:
+        dns_cache.uninstall()
+
+    if history is not None:
+        planning.save_history(settings.history, history)
+
+    if timings is not None:
+        planning.save_timings(settings.timings, timings)
 
     print()
 
+    if len(to_verify) != len(static):
+        print(f'content verified for {len(to_verify)} of {len(static)} static records')
+
+    if duplicates:
+        print(f'{len(duplicates)} static records duplicate others and only had their headers checked')
+
+    if max_bytes is not None:
+        print(f'content verification planned {planned_bytes} of {max_bytes} budgeted bytes; '
+              f'{verified_bytes} bytes verified')
+
     if errors > 0:
         die(f'found {errors} broken URLs out of {total}')
 
     print(f'success: {total} URLs validated')
 
 
+# "compare" subcommand
+
+def compare_getparser(parser):
+    add_map_arg(parser)
+    parser.add_argument(
+        '--concurrency', '-j',
+        metavar = 'N',
+        type = int,
+        default = 8,
+        help = 'Make at most N simultaneous requests (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--static-only',
+        action = 'store_true',
+        help = 'Only compare the bodies of static records, not dynamic pages',
+    )
+    add_record_filter_args(parser)
+
+def compare_impl(settings):
+    from .compare import compare_records
+    from .net import make_session
+
+    db = Database()
+    activate_maps(db, settings)
+
+    if not db._active_maps:
+        die('at least one "--map" must be specified')
+
+    session = make_session(pool_size=settings.concurrency)
+    total = 0
+    diverged = 0
+
+    for comp in compare_records(
+        db,
+        get_records_with_filtering(db, settings),
+        session,
+        concurrency = settings.concurrency,
+        compare_dynamic = not settings.static_only,
+    ):
+        total += 1
+
+        if comp.differences:
+            diverged += 1
+            print(comp.record.url(mapped=False))
+
+            for diff in comp.differences:
+                print('   ', diff)
+
+    print()
+
+    if diverged:
+        die(f'{diverged} of {total} URLs diverged')
+
+    print(f'success: {total} URLs agree')
+
+
+# "coverage" subcommand
+
+def coverage_getparser(parser):
+    parser.add_argument(
+        '--host',
+        metavar = 'HOST',
+        help = 'Assume this host name for log entries that do not record one',
+    )
+    parser.add_argument(
+        '--top', '-n',
+        metavar = 'N',
+        type = int,
+        default = 50,
+        help = 'Report the N most-hit unregistered URLs (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--include-errors',
+        action = 'store_true',
+        help = 'Also count requests that received HTTP 4xx/5xx responses',
+    )
+    parser.add_argument(
+        'logs',
+        nargs = '+',
+        metavar = 'LOGFILE',
+        help = 'Access log files to analyze (W3C, common, or combined format; may be gzipped; "-" for stdin)',
+    )
+
+def coverage_impl(settings):
+    from .coverage import CoverageAnalyzer
+
+    db = Database()
+    analyzer = CoverageAnalyzer(
+        db,
+        default_host = settings.host,
+        include_errors = settings.include_errors,
+    )
+
+    for path in settings.logs:
+        analyzer.feed_file(path)
+
+    if analyzer.total == 0:
+        die('no usable log entries found')
+
+    def pct(n):
+        return 100. * n / analyzer.total
+
+    n_unreg = sum(analyzer.unregistered.values())
+    print(f'entries:      {analyzer.total}')
+    print(f'registered:   {analyzer.registered} ({pct(analyzer.registered):.1f}%)')
+    print(f'unregistered: {n_unreg} ({pct(n_unreg):.1f}%) in {len(analyzer.unregistered)} distinct URLs')
+    print(f'unknown host: {analyzer.unknown_host} ({pct(analyzer.unknown_host):.1f}%)')
+
+    if analyzer.unknown_host and settings.host is None:
+        warn('some entries have no known host; consider using "--host"')
+
+    print()
+
+    for (dname, normpath), hits in analyzer.top_unregistered(settings.top):
+        print(f'{hits:10d}  {dname}{normpath}')
+
+
+# "digest-benchmark" subcommand
+
+def digest_benchmark_getparser(parser):
+    parser.add_argument(
+        '--size',
+        metavar = 'SIZE',
+        default = '256M',
+        help = 'Hash SIZE bytes of data with each algorithm (default: %(default)s)',
+    )
+
+def digest_benchmark_impl(settings):
+    import hashlib
+    import os
+    import time
+    from . import _BLAKE2B_DIGEST_SIZE
+    from .planning import parse_size
+
+    try:
+        size = parse_size(settings.size)
+    except ValueError as e:
+        die(f'invalid "--size" {settings.size!r}: {e}')
+
+    # Hash the same buffer repeatedly, in the same block size that we see
+    # from `requests`, so that we measure the hashing and not the I/O.
+    block = os.urandom(1024 * 1024)
+    n_blocks = max(size // len(block), 1)
+    gib = n_blocks * len(block) / 1024**3
+
+    algorithms = [
+        ('sha256', hashlib.sha256),
+        ('blake2b', lambda: hashlib.blake2b(digest_size=_BLAKE2B_DIGEST_SIZE)),
+    ]
+    cpu_per_gib = {}
+
+    for name, factory in algorithms:
+        h = factory()
+        t0 = time.process_time()
+
+        for _ in range(n_blocks):
+            h.update(block)
+
+        cpu_per_gib[name] = (time.process_time() - t0) / gib
+        print(f'{name:8}  {cpu_per_gib[name]:6.2f} CPU seconds per GiB  ({1024 / cpu_per_gib[name]:.0f} MiB/s)')
+
+    baseline = cpu_per_gib['sha256']
+    saved = baseline - cpu_per_gib['blake2b']
+    print()
+
+    if saved > 0:
+        print(f'"check --fast-digest" saves about {saved:.2f} CPU seconds per GiB verified '
+              f'({100 * saved / baseline:.0f}%)')
+    else:
+        print('SHA256 is faster on this CPU (it probably has SHA extensions), so "check --fast-digest" '
+              'will not help here')
+
+
+# "discover" subcommand
+
+def discover_getparser(parser):
+    parser.add_argument(
+        '--depth',
+        metavar = 'N',
+        type = int,
+        default = 0,
+        help = 'Follow links up to N hops beyond the starting pages (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--concurrency', '-j',
+        metavar = 'N',
+        type = int,
+        default = 8,
+        help = 'Make at most N simultaneous requests (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--per-host',
+        metavar = 'N',
+        type = int,
+        default = 4,
+        help = 'Make at most N simultaneous requests to any one host (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--max-pages-per-host',
+        metavar = 'N',
+        type = int,
+        default = 1000,
+        help = 'Fetch at most N pages from any one host (default: %(default)s)',
+    )
+    add_record_filter_args(parser)
+
+def discover_impl(settings):
+    from .discover import Crawler
+
+    db = Database()
+    crawler = Crawler(
+        db,
+        max_depth = settings.depth,
+        concurrency = settings.concurrency,
+        per_host_concurrency = settings.per_host,
+        max_pages_per_host = settings.max_pages_per_host,
+    )
+
+    candidates = crawler.crawl(get_records_with_filtering(db, settings))
+
+    for url, error in crawler.errors:
+        warn(f'failed to fetch {url}: {error}')
+
+    for cand in candidates:
+        print(f'{cand.referrers:6d}  {cand.url}  (from {cand.first_referrer})')
+
+    print()
+    print(f'{len(candidates)} unregistered URLs found in {crawler.pages_fetched} pages')
+
+
 # "dump_urls" subcommand
 
 def dump_urls_getparser(parser):
@@ -142,6 +839,333 @@ def dump_urls_impl(settings):
         print(rec.url())
 
 
+# "export" subcommand
+
+def add_bulk_format_arg(parser):
+    parser.add_argument(
+        '--format', '-f',
+        choices = ['jsonl', 'msgpack'],
+        help = 'The bulk data format (default: guessed from the file name, else jsonl)',
+    )
+
+def open_bulk_file(path, mode):
+    if path == '-':
+        if mode == 'rb':
+            return sys.stdin.buffer
+        return sys.stdout.buffer
+    return open(path, mode)
+
+def export_getparser(parser):
+    add_bulk_format_arg(parser)
+    parser.add_argument(
+        'path',
+        metavar = 'PATH',
+        help = 'The file to write ("-" for stdout)',
+    )
+
+def export_impl(settings):
+    from .bulk import guess_format, iter_items, write_items
+
+    fmt = settings.format or guess_format(settings.path)
+    db = Database()
+
+    with open_bulk_file(settings.path, 'wb') as f:
+        try:
+            write_items(iter_items(db), f, fmt)
+        except Exception as e:
+            die(str(e))
+
+
+# "export_index" subcommand
+
+def export_index_getparser(parser):
+    parser.add_argument(
+        'path',
+        metavar = 'PATH',
+        help = 'The path of the index file to create',
+    )
+
+def export_index_impl(settings):
+    from .index import write_index
+
+    write_index(Database(), settings.path)
+
+
+# "import" subcommand
+
+def import_getparser(parser):
+    add_bulk_format_arg(parser)
+    parser.add_argument(
+        'path',
+        metavar = 'PATH',
+        help = 'The file to read, as created by "export" ("-" for stdin)',
+    )
+
+def import_impl(settings):
+    from .bulk import guess_format, import_items, read_items
+
+    fmt = settings.format or guess_format(settings.path)
+    db = Database()
+
+    with open_bulk_file(settings.path, 'rb') as f:
+        try:
+            counts = import_items(db, read_items(f, fmt))
+        except Exception as e:
+            die(str(e))
+
+    for dname in sorted(counts.keys()):
+        print(f'{dname}: {counts[dname]} records')
+
+
+# "lint" subcommand
+
+def lint_getparser(parser):
+    parser.add_argument(
+        '--processes', '-j',
+        metavar = 'N',
+        type = int,
+        help = 'Use N worker processes (default: the number of CPUs)',
+    )
+    parser.add_argument(
+        'paths',
+        nargs = '*',
+        metavar = 'PATH',
+        help = 'Domain files to check (default: all files in the database)',
+    )
+
+def lint_impl(settings):
+    import os.path
+    from .lint import lint_files
+
+    paths = settings.paths
+
+    if not paths:
+        db = Database()
+        paths = [os.path.join(db._dbdir, d + '.yaml') for d in db._domains]
+
+    problems = lint_files(paths, processes=settings.processes)
+
+    for prob in problems:
+        if prob.line is None:
+            print(f'{prob.path}: {prob.message}')
+        else:
+            print(f'{prob.path}:{prob.line}: {prob.message}')
+
+    if problems:
+        die(f'found {len(problems)} problems in {len(paths)} files')
+
+
+# "mirror-groups" subcommand
+
+def mirror_groups_getparser(parser):
+    parser.add_argument(
+        '--min-members',
+        metavar = 'N',
+        type = int,
+        default = 2,
+        help = 'Only report content shared by at least N records (default: %(default)s)',
+    )
+    add_record_filter_args(parser)
+
+def mirror_groups_impl(settings):
+    from .mirrors import ContentIndex
+
+    db = Database()
+    index = ContentIndex(get_records_with_filtering(db, settings))
+    groups = index.groups(min_members=settings.min_members)
+    redundant = 0
+
+    for group in groups:
+        n = len(group.records)
+        redundant += group.length * (n - 1)
+        print(f'{group.sha256.hex()}  {n} copies of {group.length} bytes')
+
+        for rec in group.records:
+            print('   ', rec.url(mapped=False))
+
+    if groups:
+        print()
+
+    print(f'{len(groups)} groups of mirrored content among {len(index)} distinct static files; '
+          f'{redundant} redundant bytes')
+
+
+# "rebaseline" subcommand
+
+def rebaseline_getparser(parser):
+    parser.add_argument(
+        '--concurrency', '-j',
+        metavar = 'N',
+        type = int,
+        default = 8,
+        help = 'Download at most N files simultaneously (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--dry-run', '-n',
+        action = 'store_true',
+        help = 'Report changes but do not modify the database',
+    )
+    add_chunk_size_arg(parser)
+    add_blake2b_arg(parser)
+    add_record_filter_args(parser)
+
+def rebaseline_impl(settings):
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    from .net import make_session
+
+    db = Database()
+    records = [r for r in get_records_with_filtering(db, settings) if r.content_length is not None]
+    session = make_session(pool_size=settings.concurrency)
+    chunk_size = get_chunk_size(settings)
+
+    def state(rec):
+        return (
+            rec.content_type,
+            rec.content_length,
+            rec.content_sha256,
+            rec.content_chunk_sha256,
+            rec.content_blake2b,
+        )
+
+    def work(rec):
+        old = state(rec)
+        rec.initialize(
+            session,
+            static = True,
+            chunk_size = chunk_size or rec.content_chunk_size,
+            blake2b = settings.blake2b or rec.content_blake2b is not None,
+        )
+
+        if rec.content_type.startswith('X-'):
+            raise Exception(f'now returns {rec.content_type}')
+
+        return old
+
+    changed = []
+    n_errors = 0
+
+    with ThreadPoolExecutor(max_workers=settings.concurrency) as pool:
+        futures = {pool.submit(work, rec): rec for rec in records}
+
+        for fut in as_completed(futures):
+            rec = futures[fut]
+
+            try:
+                old = fut.result()
+            except Exception as e:
+                warn(f'failed to rebaseline {rec.url()}: {e}')
+                n_errors += 1
+                continue
+
+            old_ctype, old_length, old_digest, old_chunks, old_blake2b = old
+
+            if old == state(rec):
+                continue
+
+            changed.append(rec)
+            print(rec.url())
+
+            if old_ctype != rec.content_type:
+                print(f'  content-type:   {old_ctype} => {rec.content_type}')
+            if old_length != rec.content_length:
+                print(f'  content-length: {old_length} => {rec.content_length}')
+            if old_digest != rec.content_sha256:
+                print(f'  content-sha256: {old_digest.hex()} => {rec.content_sha256.hex()}')
+            if old_chunks != rec.content_chunk_sha256:
+                n_old = 0 if old_chunks is None else len(old_chunks)
+                print(f'  content-chunk-sha256: {n_old} => {len(rec.content_chunk_sha256)} chunk digests')
+            if old_blake2b != rec.content_blake2b:
+                old_hex = 'none' if old_blake2b is None else old_blake2b.hex()
+                print(f'  content-blake2b: {old_hex} => {rec.content_blake2b.hex()}')
+
+    if changed and not settings.dry_run:
+        with db.transaction() as txn:
+            for rec in changed:
+                txn.update(rec)
+
+    print()
+    print(f'{len(changed)} of {len(records)} static records changed')
+
+    if n_errors:
+        die(f'failed to rebaseline {n_errors} records')
+
+
+# "verify-mirror" subcommand
+
+def verify_mirror_getparser(parser):
+    parser.add_argument(
+        '--processes', '-j',
+        metavar = 'N',
+        type = int,
+        help = 'Hash files using N processes (default: the number of CPUs)',
+    )
+    parser.add_argument(
+        '--no-domain-dirs',
+        action = 'store_true',
+        help = 'The mirror has no per-domain subdirectories (use with "--domain")',
+    )
+    parser.add_argument(
+        '--fast-digest',
+        action = 'store_true',
+        help = 'Verify files using only the BLAKE2b digest, for records that have one',
+    )
+    parser.add_argument(
+        '--quiet', '-q',
+        action = 'store_true',
+        help = 'Only report problems',
+    )
+    add_record_filter_args(parser)
+    parser.add_argument(
+        'dir',
+        metavar = 'DIR',
+        help = 'The root directory of the mirror',
+    )
+
+def verify_mirror_impl(settings):
+    import os.path
+    from .localmirror import verify_mirror
+
+    if not os.path.isdir(settings.dir):
+        die(f'no such directory {settings.dir!r}')
+
+    db = Database()
+    counts = {}
+
+    for result in verify_mirror(
+        get_records_with_filtering(db, settings),
+        settings.dir,
+        domain_dirs = not settings.no_domain_dirs,
+        processes = settings.processes,
+        fast_digest = settings.fast_digest,
+    ):
+        counts[result.status] = counts.get(result.status, 0) + 1
+
+        if result.status in ('ok', 'unmappable') and settings.quiet:
+            continue
+
+        line = f'{result.status}: {result.record.url(mapped=False)}'
+        if result.path is not None:
+            line += f' ({result.path})'
+        if result.detail is not None:
+            line += f': {result.detail}'
+        print(line)
+
+    n_ok = counts.pop('ok', 0)
+    n_skipped = counts.pop('unmappable', 0)
+    total = n_ok + sum(counts.values())
+
+    print()
+
+    if n_skipped:
+        print(f'skipped {n_skipped} static records whose URLs do not correspond to files')
+
+    if counts:
+        summary = ', '.join(f'{n} {status}' for status, n in sorted(counts.items()))
+        die(f'{total - n_ok} of {total} static records have problems: {summary}')
+
+    print(f'success: {total} files verified')
+
+
 # The CLI driver:
 
 def entrypoint():
@@ -0,0 +1,143 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2020 the .NET Foundation
+# Distributed under the terms of the revised (3-clause) BSD license.
+
+"""Compare the responses of an original domain and a prototype deployment.
+
+For each record, we fetch the URL from both the original domain and its
+mapped alias (see :meth:`Database.activate_map`) at the same time, hashing
+both bodies in full, and report any differences in the results. Unlike
+``check``, this compares dynamic pages too, unless asked not to, in which
+case their bodies aren't even downloaded.
+
+"""
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+from urllib import parse
+
+__all__ = '''
+Comparison
+Fetched
+compare_records
+fetch
+'''.split()
+
+
+Fetched = namedtuple('Fetched', 'status content_type length sha256 location error')
+Fetched.__doc__ = '''A summary of an HTTP response. Fields are None if not
+applicable, and *length* and *sha256* are None if the body wasn't read;
+*error* is a string if the request failed outright.'''
+
+Comparison = namedtuple('Comparison', 'record original alias differences')
+Comparison.__doc__ = '''The outcome of comparing one record. *original* and
+*alias* are :class:`Fetched` tuples; *differences* is a list of strings, empty
+if the responses agree.'''
+
+
+def fetch(session, url, read_body=True):
+    """Fetch *url* without following redirects, and summarize the response.
+
+    If *read_body* is false, the body is not downloaded or hashed.
+
+    """
+
+    try:
+        with session.get(url, stream=True, allow_redirects=False) as resp:
+            location = None
+            if resp.is_redirect:
+                location = parse.urljoin(url, resp.headers['location'])
+
+            ctype = resp.headers.get('content-type')
+            if ctype is not None:
+                ctype = ctype.split(';')[0]
+
+            if not read_body:
+                return Fetched(resp.status_code, ctype, None, None, location, None)
+
+            d = hashlib.sha256()
+            count = 0
+
+            for chunk in resp.iter_content(chunk_size=65536):
+                d.update(chunk)
+                count += len(chunk)
+
+            return Fetched(resp.status_code, ctype, count, d.digest(), location, None)
+    except Exception as e:
+        return Fetched(None, None, None, None, None, str(e))
+
+
+def _differences(rec, orig, alias, compare_dynamic):
+    if orig.error is not None or alias.error is not None:
+        if orig.error == alias.error:
+            return []
+        return [f'error: {orig.error} vs. {alias.error}']
+
+    diffs = []
+
+    if orig.status != alias.status:
+        diffs.append(f'status: {orig.status} vs. {alias.status}')
+
+    # Redirects within the original domain should point to the alias, so
+    # identical locations can be a difference too.
+    expected = orig.location
+
+    if expected is not None:
+        info = parse.urlsplit(expected)
+        netloc = rec._domain._db._active_maps.get(info.netloc, info.netloc)
+        expected = parse.urlunsplit(info._replace(netloc=netloc))
+
+    if expected != alias.location:
+        diffs.append(f'redirect: {orig.location} vs. {alias.location}')
+
+    if orig.content_type != alias.content_type:
+        diffs.append(f'content-type: {orig.content_type} vs. {alias.content_type}')
+
+    if compare_dynamic or rec.content_length is not None:
+        if orig.length != alias.length:
+            diffs.append(f'content-length: {orig.length} vs. {alias.length}')
+        elif orig.sha256 != alias.sha256:
+            diffs.append('content-sha256 differs')
+
+    return diffs
+
+
+def compare_records(db, records, session, concurrency=8, compare_dynamic=True):
+    """Compare records between their original and mapped domains.
+
+    Only records whose domains have a map activated are compared. Generates
+    :class:`Comparison` tuples in the same order as *records*. Up to
+    *concurrency* requests are in flight at once, with the two fetches for
+    each record made in parallel. If *compare_dynamic* is false, the bodies
+    of dynamic records aren't downloaded, and only the lengths and digests of
+    static records are compared.
+
+    """
+    def read_body(rec):
+        return compare_dynamic or rec.content_length is not None
+
+    def finish(item):
+        rec, f_orig, f_alias = item
+        orig = f_orig.result()
+        alias = f_alias.result()
+        return Comparison(rec, orig, alias, _differences(rec, orig, alias, compare_dynamic))
+
+    records = (r for r in records if r._domain._domain in db._active_maps)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        # Keep a bounded window of work in flight so that huge selections
+        # don't queue up everything at once.
+        window = deque()
+
+        for rec in records:
+            window.append((
+                rec,
+                pool.submit(fetch, session, rec.url(mapped=False), read_body(rec)),
+                pool.submit(fetch, session, rec.url(), read_body(rec)),
+            ))
+
+            if len(window) >= 2 * concurrency:
+                yield finish(window.popleft())
+
+        while window:
+            yield finish(window.popleft())
@@ -0,0 +1,235 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2020 the .NET Foundation
+# Distributed under the terms of the revised (3-clause) BSD license.
+
+"""Analyze web-server access logs to find traffic not covered by the database.
+
+We support IIS's W3C extended log format, which is self-describing thanks to
+its ``#Fields:`` directives, as well as the Apache/NGINX "common" and
+"combined" formats. Logs may be gzip-compressed.
+
+Real-world logs contain many millions of lines but comparatively few distinct
+URLs, so URL normalization is memoized and registration is checked against
+in-memory sets of record paths rather than by re-reading the domain files.
+
+"""
+from collections import Counter
+import functools
+import io
+from urllib import parse
+
+from . import _normalize_path
+
+__all__ = '''
+CoverageAnalyzer
+open_log
+parse_log_lines
+'''.split()
+
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def open_log(path):
+    """Open a log file for reading as text, decompressing if needed.
+
+    The path ``-`` denotes standard input. Gzip compression is detected from
+    the file contents, not the file name.
+
+    """
+    import sys
+
+    if path == '-':
+        raw = sys.stdin.buffer
+    else:
+        raw = open(path, 'rb')
+
+    if not isinstance(raw, io.BufferedReader):
+        raw = io.BufferedReader(raw)
+
+    if raw.peek(2)[:2] == GZIP_MAGIC:
+        import gzip
+        raw = gzip.GzipFile(fileobj=raw, mode='rb')
+
+    # Log files are nominally ASCII, but junk requests can contain anything.
+    return io.TextIOWrapper(raw, encoding='utf-8', errors='replace')
+
+
+def _parse_w3c_line(line, fields, nfields):
+    pieces = line.split()
+    if len(pieces) != nfields:
+        return None
+
+    stem = pieces[fields['cs-uri-stem']]
+    query = pieces[fields['cs-uri-query']] if 'cs-uri-query' in fields else '-'
+
+    if query != '-':
+        target = stem + '?' + query
+    else:
+        target = stem
+
+    host = pieces[fields['cs(Host)']] if 'cs(Host)' in fields else None
+    if host == '-':
+        host = None
+
+    status = pieces[fields['sc-status']] if 'sc-status' in fields else None
+    return (host, target, status)
+
+
+def _parse_common_line(line):
+    # host ident authuser [date] "request" status bytes ["referer" "agent"]
+    #
+    # We avoid regular expressions for speed. Quotes inside the request
+    # string are escaped by the server, so the first two bare quotes delimit
+    # it.
+    start = line.find('"')
+    if start < 0:
+        return None
+
+    end = line.find('"', start + 1)
+    while end > 0 and line[end - 1] == '\\':
+        end = line.find('"', end + 1)
+    if end < 0:
+        return None
+
+    request = line[start + 1:end].split()
+    if len(request) < 2:
+        return None
+
+    rest = line[end + 1:].split(None, 1)
+    status = rest[0] if rest else None
+    return (None, request[1], status)
+
+
+def parse_log_lines(lines):
+    """Parse access log lines into ``(host, target, status)`` tuples.
+
+    *host* is None if the log format does not record it; *target* is the
+    request target, usually a path with an optional query string; *status* is
+    the HTTP status code as a string, or None if unknown. The log format is
+    detected automatically and may change partway through the input, as
+    happens when concatenating IIS logs.
+
+    """
+    w3c_fields = None
+    w3c_nfields = 0
+
+    for line in lines:
+        if line.startswith('#'):
+            if line.startswith('#Fields:'):
+                names = line[8:].split()
+                w3c_fields = {n: i for i, n in enumerate(names)}
+                w3c_nfields = len(names)
+
+                if 'cs-uri-stem' not in w3c_fields:
+                    w3c_fields = None
+            continue
+
+        if w3c_fields is not None:
+            item = _parse_w3c_line(line, w3c_fields, w3c_nfields)
+        else:
+            item = _parse_common_line(line)
+
+        if item is not None:
+            yield item
+
+
+class CoverageAnalyzer(object):
+    """Accumulate access-log hits and classify them against the database.
+
+    *default_host* is the host name assumed for log entries that don't record
+    one. If *include_errors* is false, requests that received an HTTP error
+    status (400 or above) are ignored. *cache_size* bounds the memo of
+    normalized request targets.
+
+    """
+    total = 0
+    "The number of log entries considered."
+
+    registered = 0
+    "The number of hits on URLs registered in the database."
+
+    unknown_host = 0
+    "The number of hits on hosts not known to the database."
+
+    unregistered = None
+    "A Counter of hits on unregistered URLs, keyed by (domain, normpath)."
+
+    def __init__(self, db, default_host=None, include_errors=False, cache_size=1 << 18):
+        self._db = db
+        self._default_host = default_host
+        self._include_errors = include_errors
+        self.unregistered = Counter()
+
+        self._paths = {}
+
+        for domain in db.domains():
+            self._paths[domain._domain] = frozenset(rec.path for rec in domain.records())
+
+        self._classify = functools.lru_cache(maxsize=cache_size)(self._classify_uncached)
+
+    def _classify_uncached(self, host, target):
+        """Returns None if the host is unknown, else ``(key, registered)``."""
+
+        if host is None:
+            return None
+
+        host = host.lower()
+        if ':' in host:
+            host = host.split(':', 1)[0]
+
+        dname = self._db._domain_aliases.get(host)
+        if dname is None:
+            return None
+
+        if target.startswith('http://') or target.startswith('https://'):
+            info = parse.urlsplit(target)
+            path, query = info.path, info.query
+        else:
+            path, _, query = target.partition('?')
+            path = path.split('#', 1)[0]
+            query = query.split('#', 1)[0]
+
+        try:
+            normpath = _normalize_path(path, query, self._db._case_sensitive[dname])
+        except Exception:
+            # Garbage requests from scanners can confuse the normalizer; treat
+            # them as not belonging to any domain we know about.
+            return None
+
+        return ((dname, normpath), normpath in self._paths[dname])
+
+    def feed(self, entries):
+        """Consume ``(host, target, status)`` tuples from :func:`parse_log_lines`."""
+
+        classify = self._classify
+        default_host = self._default_host
+        include_errors = self._include_errors
+        unregistered = self.unregistered
+
+        for host, target, status in entries:
+            if not include_errors and status is not None and status[:1] in ('4', '5'):
+                continue
+
+            self.total += 1
+            result = classify(host or default_host, target)
+
+            if result is None:
+                self.unknown_host += 1
+            elif result[1]:
+                self.registered += 1
+            else:
+                unregistered[result[0]] += 1
+
+    def feed_file(self, path):
+        """Parse and consume an access log file."""
+
+        with open_log(path) as f:
+            self.feed(parse_log_lines(f))
+
+    def top_unregistered(self, n):
+        """Return a list of ``((domain, normpath), hits)`` for the *n* most-hit
+        unregistered URLs.
+
+        """
+        return self.unregistered.most_common(n)
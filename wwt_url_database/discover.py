@@ -0,0 +1,285 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2020 the .NET Foundation
+# Distributed under the terms of the revised (3-clause) BSD license.
+
+"""Crawl registered pages to discover links to unregistered URLs.
+
+Starting from a set of seed records, we fetch each HTML page, extract the
+``href`` and ``src`` links, and normalize them. Links on domains that the
+database knows about but that don't correspond to any record are reported as
+candidates for registration. The crawl proceeds breadth-first up to a
+configurable depth, with a global bound on concurrency and per-host bounds on
+both concurrency and the number of pages fetched.
+
+"""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
+from html.parser import HTMLParser
+import threading
+from urllib import parse
+
+__all__ = '''
+Candidate
+Crawler
+extract_links
+'''.split()
+
+
+# Don't let a misbehaving page eat all of our memory.
+MAX_PAGE_BYTES = 8 * 1024 * 1024
+
+HTML_CONTENT_TYPES = frozenset(['text/html', 'application/xhtml+xml'])
+
+
+class _LinkParser(HTMLParser):
+    def __init__(self):
+        super(_LinkParser, self).__init__(convert_charrefs=True)
+        self.base = None
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        for name, value in attrs:
+            if value is None:
+                continue
+
+            if name in ('href', 'src'):
+                if tag == 'base' and name == 'href':
+                    self.base = value
+                else:
+                    self.links.append(value)
+
+    handle_startendtag = handle_starttag
+
+
+def extract_links(html, page_url):
+    """Extract absolute link URLs from the text of an HTML document.
+
+    Links are resolved relative to *page_url*, or the document's ``<base>``
+    element if it has one. Fragments are discarded and only HTTP(S) links are
+    returned.
+
+    """
+    p = _LinkParser()
+    p.feed(html)
+    p.close()
+
+    base = page_url
+    if p.base is not None:
+        base = parse.urljoin(page_url, p.base)
+
+    links = []
+
+    for link in p.links:
+        link = link.strip()
+
+        try:
+            url = parse.urljoin(base, link)
+        except ValueError:
+            continue  # e.g., bogus IPv6 literals
+
+        url = parse.urldefrag(url)[0]
+
+        if url.startswith('http://') or url.startswith('https://'):
+            links.append(url)
+
+    return links
+
+
+Candidate = namedtuple('Candidate', 'url domain path referrers first_referrer')
+Candidate.__doc__ = '''A discovered URL that is not registered in the database.
+
+*url* is the URL as first seen; *domain* and *path* are its normalized form;
+*referrers* is the number of distinct crawled pages linking to it; and
+*first_referrer* is the URL of one such page.'''
+
+
+def _key_hash(dname, normpath):
+    """Reduce a normalized URL to a compact 64-bit integer for the seen-set.
+
+    With 64-bit hashes, the chance of a spurious collision across even a few
+    million URLs is negligible, and Python stores each as a small int rather
+    than a pair of strings.
+
+    """
+    h = hashlib.blake2b(f'{dname}\0{normpath}'.encode('utf-8'), digest_size=8)
+    return int.from_bytes(h.digest(), 'little')
+
+
+class Crawler(object):
+    """Breadth-first link discovery starting from database records.
+
+    *concurrency* bounds the total number of simultaneous requests;
+    *per_host_concurrency* bounds the number of simultaneous requests to any
+    one host; and *max_pages_per_host* bounds the total number of pages
+    fetched from any one host. *max_depth* is the number of link hops to
+    follow beyond the seed pages: a depth of zero only looks at the seeds
+    themselves.
+
+    """
+    errors = None
+    "A list of ``(url, message)`` for pages that couldn't be fetched."
+
+    pages_fetched = 0
+
+    def __init__(
+        self,
+        db,
+        max_depth = 0,
+        concurrency = 8,
+        per_host_concurrency = 4,
+        max_pages_per_host = 1000,
+        timeout = 30,
+    ):
+        from .net import make_session
+
+        self._db = db
+        self._max_depth = max_depth
+        self._concurrency = concurrency
+        self._per_host_concurrency = per_host_concurrency
+        self._max_pages_per_host = max_pages_per_host
+        self._timeout = timeout
+        self._session = make_session(pool_size=max(concurrency, per_host_concurrency))
+
+        self._host_sems = {}
+        self._host_counts = {}
+        self._lock = threading.Lock()
+
+        self._registered = set()
+        self._seen = set()
+        self._candidates = {}
+        self.errors = []
+
+        for domain in db.domains():
+            for rec in domain.records():
+                self._registered.add(_key_hash(domain._domain, rec.path))
+
+    def _host_slot(self, host):
+        """Returns a semaphore for *host*, or None if it is over its page budget."""
+
+        with self._lock:
+            n = self._host_counts.get(host, 0)
+            if n >= self._max_pages_per_host:
+                return None
+            self._host_counts[host] = n + 1
+
+            sem = self._host_sems.get(host)
+            if sem is None:
+                sem = self._host_sems[host] = threading.BoundedSemaphore(self._per_host_concurrency)
+            return sem
+
+    def _fetch_links(self, url):
+        """Fetch *url* and return ``(links, error)``."""
+
+        host = parse.urlsplit(url).netloc
+        sem = self._host_slot(host)
+        if sem is None:
+            return [], None
+
+        # Errors can happen while reading or parsing the body too, e.g. if the
+        # connection drops partway through. Report them all for this page
+        # rather than letting them abort the whole crawl.
+        with sem:
+            try:
+                with self._session.get(url, stream=True, timeout=self._timeout) as resp:
+                    if not resp.ok:
+                        return [], f'HTTP {resp.status_code}'
+
+                    ctype = resp.headers.get('content-type', '').split(';')[0].strip()
+                    if ctype not in HTML_CONTENT_TYPES:
+                        return [], None
+
+                    body = bytearray()
+                    for chunk in resp.iter_content(chunk_size=65536):
+                        body += chunk
+                        if len(body) > MAX_PAGE_BYTES:
+                            break
+
+                    encoding = resp.encoding or 'utf-8'
+                    try:
+                        text = body.decode(encoding, errors='replace')
+                    except LookupError:
+                        text = body.decode('utf-8', errors='replace')
+
+                    links = extract_links(text, resp.url)
+            except Exception as e:
+                return [], str(e) or e.__class__.__name__
+
+        with self._lock:
+            self.pages_fetched += 1
+
+        return links, None
+
+    def _consider_links(self, page_url, links):
+        """Classify links from one page; returns the URLs worth crawling next."""
+
+        next_urls = []
+        this_page = set()
+
+        for url, norm in zip(links, self._db.normalize_many(links, strict=False)):
+            if norm is None:
+                continue  # not a domain we track
+
+            key = _key_hash(*norm)
+            if key in this_page:
+                continue
+            this_page.add(key)
+
+            if key not in self._registered:
+                cand = self._candidates.get(key)
+                if cand is None:
+                    self._candidates[key] = Candidate(url, norm[0], norm[1], 1, page_url)
+                else:
+                    self._candidates[key] = cand._replace(referrers=cand.referrers + 1)
+
+            if key not in self._seen:
+                self._seen.add(key)
+                next_urls.append(url)
+
+        return next_urls
+
+    def crawl(self, records):
+        """Crawl outward from the seed *records*.
+
+        Returns a list of :class:`Candidate` tuples, most-referenced first.
+
+        """
+        frontier = []
+
+        for rec in records:
+            key = _key_hash(rec._domain._domain, rec.path)
+            if key in self._seen:
+                continue
+
+            self._seen.add(key)
+
+            # Don't bother fetching seed records that we know aren't HTML. We
+            # can't use this trick for newly discovered links.
+            if rec.content_type in HTML_CONTENT_TYPES:
+                frontier.append(rec.url())
+
+        depth = 0
+
+        with ThreadPoolExecutor(max_workers=self._concurrency) as pool:
+            while frontier:
+                futures = {pool.submit(self._fetch_links, url): url for url in frontier}
+                frontier = []
+
+                for fut in as_completed(futures):
+                    page_url = futures[fut]
+                    links, error = fut.result()
+
+                    if error is not None:
+                        self.errors.append((page_url, error))
+                        continue
+
+                    next_urls = self._consider_links(page_url, links)
+                    if depth < self._max_depth:
+                        frontier += next_urls
+
+                depth += 1
+
+        return sorted(
+            self._candidates.values(),
+            key = lambda c: (-c.referrers, c.domain, c.path)
+        )
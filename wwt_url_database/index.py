@@ -0,0 +1,223 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2020 the .NET Foundation
+# Distributed under the terms of the revised (3-clause) BSD license.
+
+"""A compact, memory-mappable, read-only URL lookup file.
+
+This lets services ask whether a URL is registered in the database, and get
+some basic facts about it, without loading PyYAML or parsing the domain
+files. The file is opened with ``mmap``, so processes looking up URLs in the
+same index share its pages through the OS cache, and a lookup only touches
+the handful of pages visited by a binary search.
+
+The file layout is as follows; all integers are little-endian.
+
+- A 32-byte header: the magic bytes ``WWTURLX1``; a u32 giving the length of
+  the metadata section; a u32 giving the number of records; and u64 offsets
+  of the record table and the key data, both relative to the start of the
+  file.
+- The metadata section: UTF-8 JSON with the domain alias table, each
+  domain's case-sensitivity flag, and the content type and category name
+  tables.
+- The record table: one fixed-width entry per record, sorted by key. See
+  ``ENTRY_STRUCT``.
+- The key data: the concatenated keys, each the UTF-8 encoding of the domain
+  name and the normalized path separated by a NUL byte.
+
+"""
+from collections import namedtuple
+import json
+import mmap
+import os
+import struct
+from urllib import parse
+
+from . import _normalize_path
+
+__all__ = '''
+IndexEntry
+UrlIndex
+write_index
+'''.split()
+
+
+MAGIC = b'WWTURLX1'
+
+HEADER_STRUCT = struct.Struct('<8sIIQQ')
+
+# key offset, key length, content type index, flags, categories bitmask,
+# content length
+ENTRY_STRUCT = struct.Struct('<IIHHQQ4x')
+
+FLAG_STATIC = 0x1
+
+MAX_CATEGORIES = 64
+
+
+IndexEntry = namedtuple('IndexEntry', 'domain path content_type categories content_length')
+IndexEntry.__doc__ = '''Information about a URL found in a :class:`UrlIndex`.
+
+*categories* is a frozenset; *content_length* is None for non-static
+records.'''
+
+
+def _key(dname, normpath):
+    return dname.encode('utf-8') + b'\0' + normpath.encode('utf-8')
+
+
+def write_index(db, path):
+    """Write an index of all records in *db*, including deprecated ones, to *path*.
+
+    The file is written atomically.
+
+    """
+    import tempfile
+
+    entries = []
+    ctypes = {}
+    categories = {}
+
+    for domain in db.domains():
+        dname = domain._domain
+
+        for rec in domain.records():
+            ctype = ctypes.setdefault(rec.content_type, len(ctypes))
+            mask = 0
+
+            for cat in rec.categories:
+                bit = categories.setdefault(cat, len(categories))
+                if bit >= MAX_CATEGORIES:
+                    raise Exception(f'the index format supports at most {MAX_CATEGORIES} distinct categories')
+                mask |= 1 << bit
+
+            flags = 0
+            length = 0
+
+            if rec.content_length is not None:
+                flags |= FLAG_STATIC
+                length = rec.content_length
+
+            entries.append((_key(dname, rec.path), ctype, flags, mask, length))
+
+    entries.sort()
+
+    meta = {
+        'aliases': db._domain_aliases,
+        'case_sensitive': db._case_sensitive,
+        'content_types': sorted(ctypes, key=ctypes.get),
+        'categories': sorted(categories, key=categories.get),
+    }
+    meta = json.dumps(meta, sort_keys=True).encode('utf-8')
+
+    entries_offset = HEADER_STRUCT.size + len(meta)
+    keys_offset = entries_offset + ENTRY_STRUCT.size * len(entries)
+
+    dirname, basename = os.path.split(os.path.abspath(path))
+    tf = tempfile.NamedTemporaryFile(mode='wb', dir=dirname, prefix=basename, delete=False)
+
+    with tf as f:
+        f.write(HEADER_STRUCT.pack(MAGIC, len(meta), len(entries), entries_offset, keys_offset))
+        f.write(meta)
+
+        key_offset = 0
+
+        for key, ctype, flags, mask, length in entries:
+            f.write(ENTRY_STRUCT.pack(key_offset, len(key), ctype, flags, mask, length))
+            key_offset += len(key)
+
+        for entry in entries:
+            f.write(entry[0])
+
+    # The whole point is for other services to read this file.
+    os.chmod(f.name, 0o644)
+    os.replace(f.name, path)
+
+
+class UrlIndex(object):
+    """A read-only view of an index file created by :func:`write_index`.
+
+    Instances are safe to share across threads, and may be used as context
+    managers to close the underlying mapping.
+
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, meta_len, self._n, self._entries_offset, self._keys_offset = \
+            HEADER_STRUCT.unpack_from(self._mm, 0)
+
+        if magic != MAGIC:
+            self._mm.close()
+            raise Exception(f'{path!r} is not a WWT URL index file')
+
+        meta = json.loads(self._mm[HEADER_STRUCT.size:HEADER_STRUCT.size + meta_len].decode('utf-8'))
+        self._aliases = meta['aliases']
+        self._case_sensitive = meta['case_sensitive']
+        self._content_types = meta['content_types']
+        self._categories = meta['categories']
+
+    def __len__(self):
+        return self._n
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._mm.close()
+
+    def _entry(self, i):
+        return ENTRY_STRUCT.unpack_from(self._mm, self._entries_offset + i * ENTRY_STRUCT.size)
+
+    def _key_at(self, koff, klen):
+        start = self._keys_offset + koff
+        return self._mm[start:start + klen]
+
+    def get(self, dname, normpath):
+        """Look up an already-normalized path on a canonical domain name.
+
+        Returns an :class:`IndexEntry`, or None if there's no such record.
+
+        """
+        key = _key(dname, normpath)
+        lo, hi = 0, self._n
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            koff, klen, ctype, flags, mask, length = self._entry(mid)
+            probe = self._key_at(koff, klen)
+
+            if probe < key:
+                lo = mid + 1
+            elif probe > key:
+                hi = mid
+            else:
+                cats = frozenset(c for i, c in enumerate(self._categories) if mask & (1 << i))
+
+                return IndexEntry(
+                    dname,
+                    normpath,
+                    self._content_types[ctype],
+                    cats,
+                    length if flags & FLAG_STATIC else None,
+                )
+
+        return None
+
+    def lookup(self, url):
+        """Look up a URL, normalizing it in the same way as :meth:`Database.normalize`.
+
+        Returns an :class:`IndexEntry`, or None if the URL isn't registered
+        or its domain is unknown.
+
+        """
+        info = parse.urlsplit(url)
+        dname = self._aliases.get(info.netloc)
+        if dname is None:
+            return None
+
+        normpath = _normalize_path(info.path, info.query, self._case_sensitive[dname])
+        return self.get(dname, normpath)
@@ -0,0 +1,250 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2020 the .NET Foundation
+# Distributed under the terms of the revised (3-clause) BSD license.
+
+"""Check that domain files obey the invariants described in the format docs.
+
+Each file is checked in one streaming pass over its YAML nodes, so that
+problems can be reported with line numbers. Files are checked in parallel in
+a process pool; a final serial pass checks invariants that span files, such
+as no cname being claimed by more than one domain.
+
+"""
+from collections import namedtuple
+import os.path
+
+from . import _normalize_path
+
+__all__ = '''
+Problem
+lint_file
+lint_files
+'''.split()
+
+
+Problem = namedtuple('Problem', 'path line message')
+Problem.__doc__ = 'A lint violation. *line* is 1-based, or None if unknown.'
+
+_FileResult = namedtuple('_FileResult', 'path domain cnames problems')
+
+
+def _check_sorted_keys(node, add):
+    keys = [k.value for k, _ in node.value]
+
+    if keys != sorted(keys):
+        add(node, 'keys are not sorted')
+
+    seen = set()
+    for knode, _ in node.value:
+        if knode.value in seen:
+            add(knode, f'duplicate key {knode.value!r}')
+        seen.add(knode.value)
+
+
+def _check_sorted_list(node, value, what, add):
+    if not isinstance(value, list):
+        add(node, f'{what} should be a list')
+        return False
+
+    if value != sorted(value):
+        add(node, f'{what} are not sorted')
+
+    if len(set(value)) != len(value):
+        add(node, f'{what} contain duplicates')
+
+    return True
+
+
+def _value_node(node, key):
+    for knode, vnode in node.value:
+        if knode.value == key:
+            return vnode
+    return node
+
+
+def _check_record(node, doc, case_sensitive, add):
+    import yaml
+
+    if not isinstance(node, yaml.MappingNode) or not isinstance(doc, dict):
+        add(node, 'record is not a dictionary')
+        return None
+
+    _check_sorted_keys(node, add)
+
+    path = doc.get('_path')
+    if not isinstance(path, str):
+        add(node, 'record has no "_path" string')
+        return None
+
+    pnode = _value_node(node, '_path')
+
+    if 'content-type' not in doc:
+        add(node, f'record for {path} has no "content-type"')
+
+    if '#' in path:
+        add(pnode, f'path {path} contains a fragment')
+    else:
+        base, _, query = path.partition('?')
+
+        try:
+            normpath = _normalize_path(base, query, case_sensitive)
+        except Exception as e:
+            add(pnode, f'path {path} cannot be normalized: {e}')
+        else:
+            if not case_sensitive and base != base.lower():
+                add(pnode, f'path {path} is not lowercase but the domain has case-insensitive paths')
+            elif normpath != path:
+                add(pnode, f'path {path} is not normalized (should be {normpath})')
+
+    if 'categories' in doc:
+        _check_sorted_list(_value_node(node, 'categories'), doc['categories'], 'categories', add)
+
+    has_length = 'content-length' in doc
+    has_digest = 'content-sha256' in doc
+
+    if has_length != has_digest:
+        add(node, f'record for {path} should have both or neither of "content-length" and "content-sha256"')
+
+    if has_digest:
+        digest = doc['content-sha256']
+
+        if not isinstance(digest, str) or len(digest) != 64 or digest.strip('0123456789abcdef'):
+            add(_value_node(node, 'content-sha256'), 'content-sha256 should be 64 lowercase hex digits')
+
+    if 'content-blake2b' in doc:
+        digest = doc['content-blake2b']
+
+        if not has_length:
+            add(node, f'record for {path} has "content-blake2b" but no "content-length"')
+        elif not isinstance(digest, str) or len(digest) != 64 or digest.strip('0123456789abcdef'):
+            add(_value_node(node, 'content-blake2b'), 'content-blake2b should be 64 lowercase hex digits')
+
+    if ('content-chunk-size' in doc) != ('content-chunk-sha256' in doc):
+        add(node, f'record for {path} should have both or neither of "content-chunk-size" and "content-chunk-sha256"')
+    elif 'content-chunk-size' in doc:
+        size = doc['content-chunk-size']
+        chunks = doc['content-chunk-sha256']
+
+        if not has_length:
+            add(node, f'record for {path} has chunk digests but no "content-length"')
+        elif not isinstance(size, int) or size < 1:
+            add(_value_node(node, 'content-chunk-size'), 'content-chunk-size should be a positive integer')
+        elif not isinstance(chunks, list) or len(chunks) != -(-doc['content-length'] // size):
+            add(_value_node(node, 'content-chunk-sha256'), 'content-chunk-sha256 has the wrong number of digests')
+
+    return path
+
+
+def lint_file(path):
+    """Check a single domain file.
+
+    Returns a tuple ``(path, domain, cnames, problems)``, where *problems* is
+    a list of :class:`Problem` tuples.
+
+    """
+    import yaml
+
+    loader_class = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    dname = os.path.basename(path)
+    if dname.endswith('.yaml'):
+        dname = dname[:-5]
+
+    problems = []
+    cnames = []
+
+    def add(node, message):
+        line = None if node is None else node.start_mark.line + 1
+        problems.append(Problem(path, line, message))
+
+    with open(path, 'rt', encoding='utf-8') as f:
+        loader = loader_class(f)
+
+        try:
+            first = True
+            case_sensitive = True
+            prev_path = None
+            seen_paths = set()
+
+            while loader.check_node():
+                node = loader.get_node()
+                doc = loader.construct_document(node)
+
+                if first:
+                    first = False
+
+                    if doc is None:
+                        continue  # empty metadata is OK
+
+                    if not isinstance(node, yaml.MappingNode) or not isinstance(doc, dict):
+                        add(node, 'domain metadata is not a dictionary')
+                        continue
+
+                    _check_sorted_keys(node, add)
+                    case_sensitive = doc.get('case-sensitive-paths', True)
+
+                    if 'cnames' in doc:
+                        if _check_sorted_list(_value_node(node, 'cnames'), doc['cnames'], 'cnames', add):
+                            cnames = list(doc['cnames'])
+
+                    continue
+
+                rpath = _check_record(node, doc, case_sensitive, add)
+                if rpath is None:
+                    continue
+
+                if rpath in seen_paths:
+                    add(node, f'duplicate record for path {rpath}')
+                elif prev_path is not None and rpath < prev_path:
+                    add(node, f'record for {rpath} is out of order (follows {prev_path})')
+
+                seen_paths.add(rpath)
+                prev_path = rpath
+
+            if first:
+                problems.append(Problem(path, None, 'file contains no YAML documents'))
+        except yaml.MarkedYAMLError as e:
+            mark = e.problem_mark or e.context_mark
+            line = None if mark is None else mark.line + 1
+            problems.append(Problem(path, line, f'YAML error: {e.problem}'))
+        finally:
+            loader.dispose()
+
+    return _FileResult(path, dname, cnames, problems)
+
+
+def lint_files(paths, processes=None):
+    """Check a set of domain files, in parallel.
+
+    Returns a list of :class:`Problem` tuples. If *processes* is 1, everything
+    happens in the current process; otherwise it gives the size of the
+    process pool, defaulting to the number of CPUs.
+
+    """
+    paths = list(paths)
+
+    if processes == 1 or len(paths) < 2:
+        results = [lint_file(p) for p in paths]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = list(pool.map(lint_file, paths))
+
+    problems = []
+    owners = {}
+
+    for res in results:
+        problems += res.problems
+        owners.setdefault(res.domain, []).append((res.path, 'is the primary name'))
+
+        for cname in res.cnames:
+            owners.setdefault(cname, []).append((res.path, 'claims it as a cname'))
+
+    for name in sorted(owners.keys()):
+        claims = owners[name]
+
+        if len(claims) > 1:
+            desc = '; '.join(f'{p} {how}' for p, how in claims)
+            problems.append(Problem(claims[0][0], None, f'domain name {name} is claimed more than once: {desc}'))
+
+    return problems
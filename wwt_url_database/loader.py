@@ -0,0 +1,72 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2020 the .NET Foundation
+# Distributed under the terms of the revised (3-clause) BSD license.
+
+"""Parse domain files in parallel.
+
+YAML parsing is CPU-bound, so to scale operations over the whole database we
+parse the domain files in a pool of worker processes. Workers send back each
+domain's metadata and its records in the compact tuple form of
+:meth:`Record.as_tuple`, which pickles much more cheaply than record dicts.
+
+"""
+import os.path
+
+from . import Domain, Record
+
+__all__ = '''
+load_domain_file
+load_domains
+'''.split()
+
+
+def load_domain_file(path):
+    """Parse a domain file.
+
+    Returns ``(metadata, record_tuples)``, where *record_tuples* is a list of
+    tuples as returned by :meth:`Record.as_tuple`.
+
+    """
+    import yaml
+
+    loader_class = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    metadata = None
+    tuples = []
+
+    with open(path, 'rt', encoding='utf-8') as f:
+        for doc in yaml.load_all(f, Loader=loader_class):
+            if metadata is None:
+                metadata = doc or {}
+            else:
+                tuples.append(Record(None, doc).as_tuple())
+
+    return (metadata or {}, tuples)
+
+
+def load_domains(db, dnames=None, processes=None):
+    """Load domains and their records from *db* in parallel.
+
+    *dnames* is a list of canonical domain names to load, defaulting to all
+    of them. *processes* is the size of the process pool, defaulting to the
+    number of CPUs. Returns a list of ``(domain, records)`` pairs, in the
+    same order as *dnames*, where *domain* is a :class:`Domain` and *records*
+    is a list of :class:`Record` objects.
+
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    if dnames is None:
+        dnames = db._domains
+
+    paths = [os.path.join(db._dbdir, d + '.yaml') for d in dnames]
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        loaded = list(pool.map(load_domain_file, paths))
+
+    result = []
+
+    for dname, path, (metadata, tuples) in zip(dnames, paths, loaded):
+        domain = Domain(db, dname, path, metadata=metadata)
+        result.append((domain, [Record.from_tuple(domain, t) for t in tuples]))
+
+    return result
@@ -0,0 +1,195 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2020 the .NET Foundation
+# Distributed under the terms of the revised (3-clause) BSD license.
+
+"""Verify a local mirror of static content against the database.
+
+A mirror is a directory tree holding copies of the files behind static
+records. By default, the file for ``http://example.com/a/b.fits`` is expected
+at ``DIR/example.com/a/b.fits``; alternatively, the domain level can be left
+out for a mirror of a single domain. For domains with case-insensitive paths,
+the files may have any case.
+
+File sizes are checked first, which is nearly free, and only files of the
+right size are hashed. Hashing is done in a pool of processes, reading the
+files through memory maps, so that it runs at disk speed.
+
+"""
+from collections import namedtuple
+import hashlib
+import os
+from urllib import parse
+
+from . import _BLAKE2B_DIGEST_SIZE
+
+__all__ = '''
+MirrorResult
+hash_file
+verify_mirror
+'''.split()
+
+
+MirrorResult = namedtuple('MirrorResult', 'record path status detail')
+MirrorResult.__doc__ = '''The outcome of verifying one record against a
+mirror. *path* is the file that was checked, or None if the record's URL
+can't be mapped to a file. *status* is one of ``"ok"``, ``"missing"``,
+``"resized"``, ``"corrupted"``, ``"unmappable"`` or ``"error"``. *detail*
+is a string with more information, or None.'''
+
+
+def hash_file(path, blake2b=False):
+    """Compute the binary SHA256 (or, if *blake2b* is true, BLAKE2b) digest
+    of a file, reading it through a memory map.
+
+    """
+    import mmap
+
+    if blake2b:
+        h = hashlib.blake2b(digest_size=_BLAKE2B_DIGEST_SIZE)
+    else:
+        h = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+        # Empty files can't be mapped.
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if hasattr(mm, 'madvise'):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                h.update(mm)
+
+    return h.digest()
+
+
+def _hash_job(path, blake2b):
+    try:
+        return (hash_file(path, blake2b=blake2b), None)
+    except OSError as e:
+        return (None, str(e))
+
+
+# Characters that can't appear in a file name component once unquoted.
+_SEPARATORS = ('/', '\0', os.sep) + ((os.altsep,) if os.altsep else ())
+
+
+def _is_safe_part(part):
+    return part not in ('', '.', '..') and not any(c in part for c in _SEPARATORS)
+
+
+class _PathResolver(object):
+    """Map records to files, matching names case-insensitively where needed."""
+
+    def __init__(self, root, domain_dirs):
+        self._root = root
+        self._domain_dirs = domain_dirs
+        self._listings = {}
+
+    def _find_insensitive(self, parent, name):
+        listing = self._listings.get(parent)
+
+        if listing is None:
+            try:
+                listing = {e.lower(): e for e in os.listdir(parent)}
+            except OSError:
+                listing = {}
+            self._listings[parent] = listing
+
+        return listing.get(name.lower())
+
+    def resolve(self, rec):
+        """Get the path of the file for *rec*, which might not exist, or None
+        if the record can't be mapped to a file.
+
+        """
+        path = rec.path
+
+        if '?' in path or path.endswith('/'):
+            return None
+
+        # Check the parts after unquoting, since "%2F" becomes a separator.
+        parts = [parse.unquote(p) for p in path.split('/')[1:]]
+
+        if not all(_is_safe_part(p) for p in parts):
+            return None
+
+        if self._domain_dirs:
+            parts.insert(0, rec._domain._domain)
+
+        if rec._domain.has_case_sensitive_paths():
+            return os.path.join(self._root, *parts)
+
+        current = self._root
+
+        for i, part in enumerate(parts):
+            found = self._find_insensitive(current, part)
+            if found is None:
+                return os.path.join(current, *parts[i:])
+            current = os.path.join(current, found)
+
+        return current
+
+
+def verify_mirror(records, root, domain_dirs=True, processes=None, fast_digest=False):
+    """Verify the mirrored copies of static records.
+
+    *records* is an iterable of records; those that aren't static are
+    ignored. *root* is the mirror directory, and *domain_dirs* indicates
+    whether it has a subdirectory for each domain. *processes* is the size of
+    the hashing process pool, defaulting to the number of CPUs. If
+    *fast_digest* is true, records with BLAKE2b digests are verified with
+    those instead of SHA256.
+
+    Generates :class:`MirrorResult` tuples. Records that can be judged
+    without hashing come first; the rest follow in order of completion.
+
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    resolver = _PathResolver(root, domain_dirs)
+    to_hash = []
+
+    for rec in records:
+        if rec.content_length is None:
+            continue
+
+        path = resolver.resolve(rec)
+        if path is None:
+            yield MirrorResult(rec, None, 'unmappable', 'the URL does not correspond to a file')
+            continue
+
+        try:
+            size = os.stat(path).st_size
+        except FileNotFoundError:
+            yield MirrorResult(rec, path, 'missing', None)
+            continue
+        except OSError as e:
+            yield MirrorResult(rec, path, 'error', str(e))
+            continue
+
+        if size != rec.content_length:
+            yield MirrorResult(rec, path, 'resized', f'expected {rec.content_length} bytes, found {size}')
+            continue
+
+        to_hash.append((rec, path))
+
+    # Hash big files first, so that they don't straggle at the end.
+    to_hash.sort(key=lambda item: -item[0].content_length)
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = {}
+
+        for rec, path in to_hash:
+            blake2b = fast_digest and rec.content_blake2b is not None
+            futures[pool.submit(_hash_job, path, blake2b)] = (rec, path, blake2b)
+
+        for fut in as_completed(futures):
+            rec, path, blake2b = futures[fut]
+            digest, error = fut.result()
+
+            if error is not None:
+                yield MirrorResult(rec, path, 'error', error)
+            elif blake2b and digest != rec.content_blake2b:
+                yield MirrorResult(rec, path, 'corrupted', 'BLAKE2b digest differs')
+            elif not blake2b and digest != rec.content_sha256:
+                yield MirrorResult(rec, path, 'corrupted', 'SHA256 digest differs')
+            else:
+                yield MirrorResult(rec, path, 'ok', None)
@@ -0,0 +1,85 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2020 the .NET Foundation
+# Distributed under the terms of the revised (3-clause) BSD license.
+
+"""Find static records that serve identical content.
+
+Many data files are mirrored across several domains, such as
+``data1.wwtassets.org`` and ``wwtfiles.blob.core.windows.net``. Records with
+the same SHA256 digest describe the same bytes, so when checking them it's
+enough to download and verify one copy in full, and to give the others
+cheaper header-level checks.
+
+"""
+from collections import namedtuple
+
+__all__ = '''
+ContentIndex
+MirrorGroup
+'''.split()
+
+
+MirrorGroup = namedtuple('MirrorGroup', 'sha256 length records')
+MirrorGroup.__doc__ = '''A set of static records with identical content.
+*sha256* is the binary digest, *length* is the content length in bytes, and
+*records* is a tuple of the records, sorted by domain and path.'''
+
+
+def _sort_key(rec):
+    return (rec._domain._domain, rec.path)
+
+
+class ContentIndex(object):
+    """An index of static records by the SHA256 digest of their content.
+
+    Records in *records* that aren't static are ignored.
+
+    """
+    def __init__(self, records):
+        by_digest = {}
+
+        for rec in records:
+            if rec.content_length is not None:
+                by_digest.setdefault(rec.content_sha256, []).append(rec)
+
+        self._groups = {}
+
+        for digest, recs in by_digest.items():
+            recs.sort(key=_sort_key)
+            self._groups[digest] = MirrorGroup(digest, recs[0].content_length, tuple(recs))
+
+    def __len__(self):
+        "The number of distinct pieces of content in the index."
+        return len(self._groups)
+
+    def lookup(self, sha256):
+        """Get a tuple of the records whose content has the binary digest *sha256*."""
+        group = self._groups.get(sha256)
+        return () if group is None else group.records
+
+    def groups(self, min_members=2):
+        """Get a list of :class:`MirrorGroup` tuples with at least *min_members* records.
+
+        The groups are sorted with the most redundant bytes first.
+
+        """
+        groups = [g for g in self._groups.values() if len(g.records) >= min_members]
+        groups.sort(key=lambda g: (-g.length * (len(g.records) - 1), g.sha256))
+        return groups
+
+    def split(self):
+        """Choose one record to represent each piece of content.
+
+        Returns ``(primaries, duplicates)``, two lists of records. The first
+        contains one record for each distinct digest, and the second contains
+        all the rest.
+
+        """
+        primaries = []
+        duplicates = []
+
+        for group in self._groups.values():
+            primaries.append(group.records[0])
+            duplicates.extend(group.records[1:])
+
+        return primaries, duplicates
@@ -0,0 +1,193 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2020 the .NET Foundation
+# Distributed under the terms of the revised (3-clause) BSD license.
+
+"""Helpers for the network side of things.
+
+This module imports `requests`, so it should only be imported by code that is
+actually about to make HTTP requests.
+
+"""
+import socket
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+__all__ = '''
+DNSCache
+make_session
+prewarm
+'''.split()
+
+
+# The number of per-host connection pools that a session keeps. Evicting a
+# pool closes its keep-alive connections, so this should exceed the number of
+# hosts that a run talks to.
+HOST_POOLS = 64
+
+
+def make_session(pool_size=None):
+    """Create a `requests` session suitable for concurrent use.
+
+    A single session is shared among worker threads so that they all draw
+    from one pool of keep-alive connections. If *pool_size* is given, the
+    per-host connection pool is sized to match, so that that many workers can
+    talk to the same host without connections being discarded.
+
+    """
+    session = requests.Session()
+
+    if pool_size is not None:
+        adapter = HTTPAdapter(pool_connections=max(pool_size, HOST_POOLS), pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+    return session
+
+
+class DNSCache(object):
+    """An in-process cache of host name lookups.
+
+    While installed, this replaces :func:`socket.getaddrinfo`, so it affects
+    all connections made by the process. Python's resolver interface doesn't
+    report the TTLs of DNS records, so results are kept for a fixed *ttl*
+    seconds, and failed lookups for *negative_ttl* seconds. This object is
+    thread-safe, and can be used as a context manager to install it
+    temporarily.
+
+    """
+    hits = 0
+    misses = 0
+
+    def __init__(self, ttl=300., negative_ttl=30.):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._original = None
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        """A caching replacement for :func:`socket.getaddrinfo`."""
+
+        key = (host, port, family, type, proto, flags)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._cache.get(key)
+
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                result = entry[1]
+
+                if isinstance(result, socket.gaierror):
+                    raise socket.gaierror(*result.args)
+                return list(result)
+
+            self.misses += 1
+
+        # Several threads may look up the same name at once. That's harmless.
+        resolve = self._original or socket.getaddrinfo
+
+        try:
+            result = resolve(host, port, family, type, proto, flags)
+        except socket.gaierror as e:
+            with self._lock:
+                self._cache[key] = (now + self.negative_ttl, e)
+            raise
+
+        with self._lock:
+            self._cache[key] = (now + self.ttl, tuple(result))
+
+        return result
+
+    def install(self):
+        """Start using this cache for all name lookups in the process."""
+
+        if self._original is None:
+            self._original = socket.getaddrinfo
+            socket.getaddrinfo = self.getaddrinfo
+
+    def uninstall(self):
+        """Restore the previous :func:`socket.getaddrinfo`."""
+
+        if self._original is not None:
+            socket.getaddrinfo = self._original
+            self._original = None
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, *exc):
+        self.uninstall()
+
+
+def _warm_origin(session, origin, n_conns):
+    adapter = session.get_adapter(origin)
+
+    # E.g., the adapters in `wwt_url_database.replay` have no pools.
+    if not hasattr(adapter, 'get_connection_with_tls_context') and not hasattr(adapter, 'get_connection'):
+        return None
+
+    url = origin + '/'
+    request = requests.Request('GET', url).prepare()
+    settings = session.merge_environment_settings(url, {}, None, None, None)
+
+    if hasattr(adapter, 'get_connection_with_tls_context'):
+        pool = adapter.get_connection_with_tls_context(
+            request,
+            settings['verify'],
+            proxies = settings['proxies'],
+            cert = settings['cert'],
+        )
+    else:
+        pool = adapter.get_connection(url, settings['proxies'])
+
+    conns = []
+
+    try:
+        for _ in range(n_conns):
+            conn = pool._get_conn()
+            conns.append(conn)
+            conn.connect()
+    except Exception as e:
+        return str(e)
+    finally:
+        for conn in conns:
+            pool._put_conn(conn)
+
+    return None
+
+
+def prewarm(session, urls, connections=1, concurrency=16):
+    """Open connections to the servers of *urls* ahead of time.
+
+    For each distinct scheme and host among *urls*, up to *connections*
+    connections are opened, including any TLS handshakes, and left in the
+    connection pools of *session*, so that requests made later don't pay for
+    that setup. Fewer connections are opened to hosts with fewer URLs.
+    Hosts are contacted in parallel, up to *concurrency* at once. No HTTP
+    requests are made.
+
+    Returns a dict mapping each origin (e.g. ``"https://example.com"``) to
+    None if it was prewarmed successfully, or a string describing the problem
+    if not.
+
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from urllib import parse
+
+    counts = {}
+
+    for url in urls:
+        info = parse.urlsplit(url)
+        origin = f'{info.scheme}://{info.netloc}'
+        counts[origin] = counts.get(origin, 0) + 1
+
+    origins = sorted(counts)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        problems = pool.map(lambda o: _warm_origin(session, o, min(counts[o], connections)), origins)
+        return dict(zip(origins, problems))
@@ -0,0 +1,253 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2020 the .NET Foundation
+# Distributed under the terms of the revised (3-clause) BSD license.
+
+"""Plan how much work a check run should do for each record.
+
+Verifying the content of static records means downloading them in full, which
+dominates the cost of a check run. The tools here decide which records get
+that treatment in a given run.
+
+Some planning uses a *history*: a dict mapping :func:`history_key` strings to
+the ISO date on which each record's content was last successfully verified.
+It is stored as a small JSON file between runs.
+
+Scheduling can use *timings*: a dict mapping :func:`history_key` strings to
+dicts with keys ``elapsed``, the number of seconds that the last check of the
+record took, and ``bytes``, the number of bytes of content that check
+downloaded for verification. They are stored like histories.
+
+"""
+import datetime
+import hashlib
+import json
+import os
+
+__all__ = '''
+ContentSampler
+history_key
+load_history
+load_timings
+order_longest_first
+parse_fraction
+parse_size
+plan_content_budget
+save_history
+save_timings
+'''.split()
+
+
+def parse_fraction(text):
+    """Parse a string like ``"1/7"`` into a tuple of integers ``(1, 7)``.
+
+    Raises ValueError if the fraction is malformed or not in (0, 1].
+
+    """
+    num, sep, denom = text.partition('/')
+    if not sep:
+        raise ValueError(f'expected a fraction like "1/7", got {text!r}')
+
+    num = int(num)
+    denom = int(denom)
+
+    if num < 1 or denom < num:
+        raise ValueError(f'the fraction {text!r} must be between 0 and 1')
+
+    return (num, denom)
+
+
+class ContentSampler(object):
+    """Deterministically choose a rotating subset of records to verify fully.
+
+    Each record is assigned to one of *denom* buckets by a hash of its domain
+    and path. A run on a given date selects *num* consecutive buckets,
+    advancing by *num* buckets each day, so that with daily runs every record
+    is selected at least once every ``ceil(denom / num)`` days. *run_date*
+    defaults to the current UTC date.
+
+    """
+    def __init__(self, num, denom, run_date=None):
+        if run_date is None:
+            run_date = datetime.datetime.utcnow().date()
+
+        self.num = num
+        self.denom = denom
+        self._offset = (run_date.toordinal() * num) % denom
+
+    def bucket(self, rec):
+        key = f'{rec._domain._domain}\0{rec.path}'.encode('utf-8')
+        h = hashlib.sha256(key).digest()
+        return int.from_bytes(h[:8], 'little') % self.denom
+
+    def selected(self, rec):
+        """Return True if *rec* should get full content verification today."""
+        return (self.bucket(rec) - self._offset) % self.denom < self.num
+
+
+_SIZE_SUFFIXES = {
+    '': 1,
+    'k': 1024,
+    'm': 1024**2,
+    'g': 1024**3,
+    't': 1024**4,
+}
+
+
+def parse_size(text):
+    """Parse a byte count like ``"500M"`` or ``"2GiB"`` into an integer.
+
+    Suffixes are case-insensitive and denote powers of 1024. Raises
+    ValueError if the size is malformed.
+
+    """
+    t = text.strip().lower()
+
+    for tail in ('ib', 'b'):
+        if t.endswith(tail) and len(t) > len(tail):
+            t = t[:-len(tail)]
+            break
+
+    suffix = t[-1:] if t[-1:].isalpha() else ''
+    scale = _SIZE_SUFFIXES.get(suffix)
+    number = t[:len(t) - len(suffix)]
+
+    try:
+        if scale is None:
+            raise ValueError()
+        value = int(float(number) * scale)
+    except ValueError:
+        raise ValueError(f'expected a size like "500M", got {text!r}')
+
+    if value < 0:
+        raise ValueError(f'the size {text!r} is negative')
+
+    return value
+
+
+def history_key(rec):
+    return f'{rec._domain._domain}{rec.path}'
+
+
+def _load_json(path):
+    try:
+        with open(path, 'rt') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_json(path, data):
+    tmp = path + '.tmp'
+
+    with open(tmp, 'wt') as f:
+        json.dump(data, f, indent=0, sort_keys=True)
+
+    os.replace(tmp, path)
+
+
+def load_history(path):
+    """Load a verification history file, returning an empty history if it
+    doesn't exist.
+
+    """
+    return _load_json(path)
+
+
+def save_history(path, history):
+    """Atomically write a verification history file."""
+    _save_json(path, history)
+
+
+def load_timings(path):
+    """Load a check timings file, returning empty timings if it doesn't
+    exist.
+
+    """
+    return _load_json(path)
+
+
+def save_timings(path, timings):
+    """Atomically write a check timings file."""
+    _save_json(path, timings)
+
+
+def plan_content_budget(records, max_bytes, history=None, priority_categories=()):
+    """Choose which static records to fully verify within a download budget.
+
+    The stored ``content_length`` of each record in *records* is taken as the
+    cost of verifying it. Records in any of *priority_categories* go first;
+    then records whose content was verified least recently according to
+    *history*, with never-verified records first of all; then smaller
+    records before bigger ones. Records are taken greedily in that order,
+    skipping any that don't fit in what remains of *max_bytes*.
+
+    Returns ``(selected, planned_bytes)``, where *selected* is a list of the
+    chosen records.
+
+    """
+    history = history or {}
+    priority_categories = frozenset(priority_categories)
+
+    def sort_key(rec):
+        return (
+            not (rec.categories & priority_categories),
+            history.get(history_key(rec), ''),
+            rec.content_length,
+        )
+
+    selected = []
+    remaining = max_bytes
+
+    for rec in sorted(records, key=sort_key):
+        if rec.content_length <= remaining:
+            selected.append(rec)
+            remaining -= rec.content_length
+
+    return selected, max_bytes - remaining
+
+
+def order_longest_first(records, verify=None, timings=None, latency=0.5, throughput=4 * 1024**2):
+    """Sort records so that the checks expected to take longest come first.
+
+    Starting the slowest work first lets it overlap with the long tail of
+    quick checks, which shortens the total run time for a given number of
+    workers.
+
+    *verify* is a callable taking a record and returning whether its content
+    will be verified; by default, no content is. The expected time of a
+    check is its latency plus, if its content will be verified, its stored
+    content length divided by the download throughput. If *timings* has an
+    entry for a record, its latency is taken from there. Otherwise it's the
+    median of the latencies in *timings*, or *latency* seconds if there are
+    none. *throughput* is in bytes per second, and is estimated from
+    *timings* if they include any downloads.
+
+    Returns a new list.
+
+    """
+    timings = timings or {}
+
+    downloads = [t for t in timings.values() if t.get('bytes')]
+    total_bytes = sum(t['bytes'] for t in downloads)
+    total_time = sum(t['elapsed'] for t in downloads)
+
+    if total_bytes and total_time > 0:
+        throughput = total_bytes / total_time
+
+    def latency_of(t):
+        return max(t['elapsed'] - t.get('bytes', 0) / throughput, 0.)
+
+    known = sorted(latency_of(t) for t in timings.values())
+    if known:
+        latency = known[(len(known) - 1) // 2]
+
+    def cost(rec):
+        t = timings.get(history_key(rec))
+        c = latency if t is None else latency_of(t)
+
+        if verify is not None and rec.content_length is not None and verify(rec):
+            c += rec.content_length / throughput
+
+        return c
+
+    return sorted(records, key=cost, reverse=True)
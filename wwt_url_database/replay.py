@@ -0,0 +1,308 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2020 the .NET Foundation
+# Distributed under the terms of the revised (3-clause) BSD license.
+
+"""Record HTTP traffic to a directory and replay it later, offline.
+
+These are `requests` transport adapters. Mount a :class:`RecordingAdapter`
+on a session to capture the responses to its requests, then mount a
+:class:`ReplayAdapter` pointing at the same directory to serve them back
+without touching the network. This makes it possible to re-run checks
+quickly and deterministically, e.g. to test changes to the checking logic or
+to benchmark it.
+
+Each request is identified by its method, URL, and ``Range`` header. For each
+one we store a JSON file with the status, headers, length and SHA256 and
+BLAKE2b digests of the body. Bodies no larger than a size limit are stored in
+full alongside it. Larger bodies are replayed as empty streams carrying the
+recorded digests, which the content verification code in :class:`Record`
+knows to use in place of hashing.
+
+Bodies are recorded as the caller reads them, so recording doesn't download
+anything that the run wouldn't have. If a body isn't read to the end, as in
+a check of headers only, only the status and headers are stored, and reading
+the body during a replay is an error. A recording can therefore only replay
+runs that read no more than the recorded run did.
+
+"""
+import hashlib
+import io
+import json
+import os.path
+
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.exceptions import ChunkedEncodingError, ConnectionError, ContentDecodingError
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from urllib3.exceptions import DecodeError, ProtocolError, ReadTimeoutError
+
+from . import _BLAKE2B_DIGEST_SIZE
+
+__all__ = '''
+DEFAULT_MAX_BODY
+RecordingAdapter
+ReplayAdapter
+install_recorder
+install_replayer
+'''.split()
+
+
+DEFAULT_MAX_BODY = 1024 * 1024
+
+READ_SIZE = 1024 * 1024
+
+
+def _request_key(request):
+    ident = '\n'.join((request.method, request.url, request.headers.get('Range', '')))
+    return hashlib.sha256(ident.encode('utf-8')).hexdigest()
+
+
+class _BodyReader(object):
+    """A file-like response body that never reads everything in one go.
+
+    `requests` reads file-like bodies with ``read(chunk_size)``, where the
+    chunk size may be None; we don't want that to mean "slurp a multi-gigabyte
+    file into memory".
+
+    """
+    def __init__(self, f):
+        self._f = f
+
+    def read(self, size=None):
+        if size is None or size < 0:
+            size = READ_SIZE
+        return self._f.read(size)
+
+    def close(self):
+        self._f.close()
+
+    def release_conn(self):
+        pass
+
+
+def _build_response(adapter, request, status, reason, headers, body_file):
+    resp = Response()
+    resp.status_code = status
+    resp.reason = reason
+    resp.headers = CaseInsensitiveDict(headers)
+    resp.encoding = get_encoding_from_headers(resp.headers)
+    resp.raw = _BodyReader(body_file)
+    resp.url = request.url
+    resp.request = request
+    resp.connection = adapter
+    return resp
+
+
+def _write_atomically(path, data, mode='wb'):
+    with open(path + '.tmp', mode) as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+
+
+def _write_info(base, info):
+    _write_atomically(base + '.json', json.dumps(info, indent=2, sort_keys=True), mode='wt')
+
+
+class _RecordingBody(object):
+    """A response body that records itself as the caller reads it.
+
+    The body is decoded, hashed, and (if it's small enough) saved as it
+    passes through. If the caller reads it to the end, the recording is
+    completed with the body's length and digests; otherwise, only the
+    headers that were recorded up front remain.
+
+    """
+    def __init__(self, resp, base, info, max_body):
+        self._resp = resp
+        self._base = base
+        self._info = info
+        self._max_body = max_body
+        self._chunks = resp.raw.stream(READ_SIZE, decode_content=True)
+        self._pending = b''
+        self._eof = False
+        self._sha256 = hashlib.sha256()
+        self._blake2b = hashlib.blake2b(digest_size=_BLAKE2B_DIGEST_SIZE)
+        self._length = 0
+        self._body = io.BytesIO()
+
+    def _next_chunk(self):
+        # Translate errors as `requests` does when it reads a body itself.
+        try:
+            return next(self._chunks, None)
+        except ProtocolError as e:
+            raise ChunkedEncodingError(e)
+        except DecodeError as e:
+            raise ContentDecodingError(e)
+        except ReadTimeoutError as e:
+            raise ConnectionError(e)
+
+    def _finish(self):
+        headers = CaseInsensitiveDict(self._info['headers'])
+
+        # The body has been decoded, so the recorded headers shouldn't claim
+        # otherwise, and Content-Length should describe what we stored.
+        if headers.pop('Content-Encoding', None) is not None and 'Content-Length' in headers:
+            headers['Content-Length'] = str(self._length)
+
+        self._info.update(
+            headers = dict(headers),
+            complete = True,
+            length = self._length,
+            sha256 = self._sha256.hexdigest(),
+            blake2b = self._blake2b.hexdigest(),
+            body = self._body is not None,
+        )
+
+        if self._body is not None:
+            _write_atomically(self._base + '.body', self._body.getvalue())
+
+        _write_info(self._base, self._info)
+
+    def read(self, size):
+        while not self._pending and not self._eof:
+            chunk = self._next_chunk()
+
+            if chunk is None:
+                self._eof = True
+                self._finish()
+                break
+
+            self._sha256.update(chunk)
+            self._blake2b.update(chunk)
+            self._length += len(chunk)
+
+            if self._body is not None:
+                if self._length > self._max_body:
+                    self._body = None
+                else:
+                    self._body.write(chunk)
+
+            self._pending = chunk
+
+        data = self._pending[:size]
+        self._pending = self._pending[size:]
+        return data
+
+    def close(self):
+        self._resp.close()
+
+
+class RecordingAdapter(HTTPAdapter):
+    """An HTTP adapter that saves every response it receives into *recdir*.
+
+    Responses are recorded lazily: bodies are only downloaded as far as the
+    caller reads them, so recording doesn't change how much a run downloads.
+    A body that isn't read to the end isn't recorded, and can't be replayed.
+    Bodies larger than *max_body* bytes are only stored as digests.
+
+    """
+    def __init__(self, recdir, max_body=DEFAULT_MAX_BODY, **kwargs):
+        super(RecordingAdapter, self).__init__(**kwargs)
+        self._recdir = recdir
+        self._max_body = max_body
+        os.makedirs(recdir, exist_ok=True)
+
+    def send(self, request, **kwargs):
+        kwargs['stream'] = True
+        resp = super(RecordingAdapter, self).send(request, **kwargs)
+        base = os.path.join(self._recdir, _request_key(request))
+
+        # Record the headers now, in case the body is never read.
+        info = {
+            'method': request.method,
+            'url': request.url,
+            'range': request.headers.get('Range'),
+            'status': resp.status_code,
+            'reason': resp.reason,
+            'headers': dict(resp.headers),
+            'complete': False,
+            'body': False,
+        }
+        _write_info(base, info)
+
+        body = _RecordingBody(resp, base, info, self._max_body)
+        return _build_response(self, request, resp.status_code, resp.reason, resp.headers, body)
+
+
+class _UnrecordedBody(object):
+    def __init__(self, request):
+        self._request = request
+
+    def read(self, size):
+        msg = f'the body of the response to {self._request.method} {self._request.url} was not recorded'
+        raise ConnectionError(msg, request=self._request)
+
+    def close(self):
+        pass
+
+
+class ReplayAdapter(BaseAdapter):
+    """An adapter that answers requests from responses recorded in *recdir*.
+
+    Requests that were never recorded fail with a
+    :exc:`requests.ConnectionError`, as if the host were unreachable, as do
+    attempts to read bodies that weren't recorded.
+
+    """
+    def __init__(self, recdir):
+        super(ReplayAdapter, self).__init__()
+        self._recdir = recdir
+
+    def send(self, request, **kwargs):
+        base = os.path.join(self._recdir, _request_key(request))
+
+        try:
+            with open(base + '.json', 'rt') as f:
+                info = json.load(f)
+        except FileNotFoundError:
+            raise ConnectionError(f'no recorded response for {request.method} {request.url}', request=request)
+
+        # Recordings made before bodies were recorded lazily are complete.
+        complete = info.get('complete', True)
+
+        if info['body']:
+            body = open(base + '.body', 'rb')
+        elif complete:
+            body = io.BytesIO(b'')
+        else:
+            body = _UnrecordedBody(request)
+
+        resp = _build_response(self, request, info['status'], info['reason'], info['headers'], body)
+
+        if complete and not info['body']:
+            resp.wwt_precomputed_digests = {
+                'length': info['length'],
+                'sha256': bytes.fromhex(info['sha256']),
+            }
+
+            if 'blake2b' in info:
+                resp.wwt_precomputed_digests['blake2b'] = bytes.fromhex(info['blake2b'])
+
+        return resp
+
+    def close(self):
+        pass
+
+
+def install_recorder(session, recdir, max_body=DEFAULT_MAX_BODY, pool_size=None):
+    """Make *session* record all of its HTTP(S) traffic into *recdir*."""
+
+    kwargs = {}
+    if pool_size is not None:
+        kwargs = dict(pool_connections=pool_size, pool_maxsize=pool_size)
+
+    adapter = RecordingAdapter(recdir, max_body=max_body, **kwargs)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+
+def install_replayer(session, recdir):
+    """Make *session* serve all of its HTTP(S) requests from *recdir*."""
+
+    if not os.path.isdir(recdir):
+        raise Exception(f'no such recording directory {recdir!r}')
+
+    adapter = ReplayAdapter(recdir)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
@@ -0,0 +1,275 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2020 the .NET Foundation
+# Distributed under the terms of the revised (3-clause) BSD license.
+
+"""Immutable views of the database for sharing between threads.
+
+:class:`Database`, :class:`Domain` and :class:`Record` objects are mutable
+and reread the domain files on demand, so they're not suitable for serving
+lookups from many threads at once. A :class:`Snapshot` loads everything up
+front into immutable :class:`FrozenRecord` tuples and is never modified
+afterwards, so any number of threads can query it without locking.
+
+A :class:`SharedSnapshot` holds the current snapshot of a database directory
+and replaces it with a fresh one when the domain files change. The new
+snapshot is built off to the side and swapped in with a single reference
+assignment, so readers never block and always see a complete, consistent
+snapshot.
+
+"""
+from collections import namedtuple
+import functools
+import os
+import threading
+from types import MappingProxyType
+from urllib import parse
+
+from . import Database, _normalize_path
+
+__all__ = '''
+FrozenRecord
+SharedSnapshot
+Snapshot
+'''.split()
+
+
+FrozenRecord = namedtuple(
+    'FrozenRecord',
+    'domain path url content_type content_length content_sha256 content_blake2b content_chunk_size '
+    'content_chunk_sha256 categories redirect_target extras'
+)
+FrozenRecord.__doc__ = '''An immutable copy of a :class:`Record`. *domain* is
+the canonical domain name and *url* is the record's URL, ignoring any active
+maps. *content_chunk_sha256* is a tuple or None, *categories* is a frozenset,
+and *extras* is a read-only mapping.'''
+
+
+def _freeze(rec):
+    chunks = rec.content_chunk_sha256
+
+    return FrozenRecord(
+        rec._domain._domain,
+        rec.path,
+        rec.url(mapped=False),
+        rec.content_type,
+        rec.content_length,
+        rec.content_sha256,
+        rec.content_blake2b,
+        rec.content_chunk_size,
+        tuple(chunks) if chunks is not None else None,
+        frozenset(rec.categories),
+        rec.redirect_target,
+        MappingProxyType(dict(rec.extras)),
+    )
+
+
+def _signature(dbdir):
+    """Get a value that changes whenever the domain files in *dbdir* change."""
+
+    sig = []
+
+    for entry in os.scandir(dbdir):
+        if entry.name.endswith('.yaml'):
+            st = entry.stat()
+            sig.append((entry.name, st.st_mtime_ns, st.st_size))
+
+    return tuple(sorted(sig))
+
+
+class Snapshot(object):
+    """A frozen, thread-safe view of all of the records in a database.
+
+    *db* is the :class:`Database` to load. If *processes* is greater than
+    one, the domain files are parsed in parallel as in
+    :meth:`Database.get_records`. Usually you'll get one of these from
+    :meth:`Database.snapshot`.
+
+    Deprecated records are included, so that lookups by URL find them as
+    :meth:`Database.get_record` does, but :meth:`records` skips them as
+    :meth:`Database.get_records` does.
+
+    """
+    dbdir = None
+    "The database directory that this snapshot was loaded from."
+
+    domains = None
+    "A sorted tuple of the canonical names of the domains in the snapshot."
+
+    signature = None
+    "The state of the domain files when loading started; see :meth:`is_stale`."
+
+    def __init__(self, db, processes=None):
+        # Take the signature first, so that any change made while we're
+        # loading will make us look stale.
+        self.dbdir = db._dbdir
+        self.signature = _signature(db._dbdir)
+        self.domains = tuple(db._domains)
+
+        self._domain_aliases = dict(db._domain_aliases)
+        self._case_sensitive = dict(db._case_sensitive)
+        self._records = {}
+
+        by_domain = {dname: [] for dname in self.domains}
+
+        if processes is not None and processes > 1:
+            from .loader import load_domains
+            loaded = load_domains(db, self.domains, processes=processes)
+        else:
+            loaded = ((d, d.records()) for d in db.domains())
+
+        for _domain, records in loaded:
+            for rec in records:
+                frec = _freeze(rec)
+                self._records[(frec.domain, frec.path)] = frec
+                by_domain[frec.domain].append(frec)
+
+        self._by_domain = {
+            dname: tuple(sorted(recs, key=lambda r: r.path))
+            for dname, recs in by_domain.items()
+        }
+
+        # lru_cache is thread-safe.
+        self._normpath = functools.lru_cache(maxsize=65536)(_normalize_path)
+
+    def __len__(self):
+        "The number of records in the snapshot, including deprecated ones."
+        return len(self._records)
+
+    def is_stale(self):
+        """Return True if the domain files have changed since this snapshot was loaded."""
+        return _signature(self.dbdir) != self.signature
+
+    def normalize(self, url):
+        """Normalize a URL, as with :meth:`Database.normalize`.
+
+        Returns ``(domain, normpath)``, or None if the URL isn't on a known
+        domain.
+
+        """
+        info = parse.urlsplit(url)
+        dname = self._domain_aliases.get(info.netloc)
+        if dname is None:
+            return None
+
+        return (dname, self._normpath(info.path, info.query, self._case_sensitive[dname]))
+
+    def lookup(self, domain, path):
+        """Get the :class:`FrozenRecord` for a canonical domain name and
+        normalized path, or None if there isn't one.
+
+        """
+        return self._records.get((domain, path))
+
+    def get_record(self, url):
+        """Get the :class:`FrozenRecord` for *url*, or None if it isn't
+        registered.
+
+        """
+        key = self.normalize(url)
+        if key is None:
+            return None
+        return self._records.get(key)
+
+    def records(self, category=None, domain=None, path_prefix=None):
+        """Generate :class:`FrozenRecord` tuples, filtered as with
+        :meth:`Database.get_records`. Deprecated records are skipped.
+
+        """
+        if domain is None:
+            dnames = self.domains
+        else:
+            dname = self._domain_aliases.get(domain)
+            if dname is None:
+                raise Exception(f'illegal domain name {domain!r}')
+            dnames = [dname]
+
+        for dname in dnames:
+            for rec in self._by_domain[dname]:
+                if category is not None and category not in rec.categories:
+                    continue
+                if path_prefix is not None and not rec.path.startswith(path_prefix):
+                    continue
+                if 'deprecated' in rec.categories:
+                    continue
+                yield rec
+
+
+class SharedSnapshot(object):
+    """The current :class:`Snapshot` of a database, reloaded when it changes.
+
+    Readers should fetch :attr:`current` once per unit of work and query the
+    snapshot that it returns; this never blocks. Call :meth:`reload` to
+    check for changes to the domain files, or :meth:`watch` to do so
+    periodically in a background thread.
+
+    *dbdir* is the database directory, defaulting to the one bundled with
+    this package. *processes* is as for :class:`Snapshot`.
+
+    """
+    reload_error = None
+    "The exception raised by the most recent failed reload, or None."
+
+    def __init__(self, dbdir=None, processes=None):
+        self._dbdir = dbdir
+        self._processes = processes
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+        self._current = self._load()
+
+    def _load(self):
+        return Snapshot(Database(self._dbdir), processes=self._processes)
+
+    @property
+    def current(self):
+        "The most recently loaded :class:`Snapshot`."
+        return self._current
+
+    def reload(self, force=False):
+        """Load a new snapshot if the domain files have changed.
+
+        If *force* is true, reload even if nothing seems to have changed.
+        Readers keep using the old snapshot until the new one is complete.
+        Returns True if a new snapshot was swapped in. Loading errors are
+        raised, and leave the current snapshot in place.
+
+        """
+        # Only one reload at a time; readers don't take this lock.
+        with self._reload_lock:
+            if not force and not self._current.is_stale():
+                return False
+
+            self._current = self._load()
+            return True
+
+    def watch(self, interval=10.0):
+        """Start a daemon thread that calls :meth:`reload` every *interval*
+        seconds.
+
+        Reload errors are stored in :attr:`reload_error` and don't stop the
+        thread; the current snapshot keeps being served until a reload
+        succeeds.
+
+        """
+        if self._watcher is not None:
+            raise Exception('already watching for changes')
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.reload()
+                    self.reload_error = None
+                except Exception as e:
+                    self.reload_error = e
+
+        self._stop.clear()
+        self._watcher = threading.Thread(target=run, name='wwt-url-database-watcher', daemon=True)
+        self._watcher.start()
+
+    def close(self):
+        """Stop the thread started by :meth:`watch`, if any."""
+
+        if self._watcher is not None:
+            self._stop.set()
+            self._watcher.join()
+            self._watcher = None
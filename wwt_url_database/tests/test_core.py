@@ -2,12 +2,1212 @@
 # Copyright 2019 the .Net Foundation
 # Distributed under the terms of the revised (3-clause) BSD license.
 
-"""Empty for now.
+"""Tests of the URL database and the tools that work with it.
 
-NOTE: these tests do not perform the actual testing of WWT URLs. They just
-check that the URL database is correctly formatted, more or less.
+NOTE: these tests do not perform the actual testing of WWT URLs. They check
+that the URL database is correctly formatted, more or less, and exercise the
+tools against small fixture databases, with HTTP served from recordings or
+local test servers rather than the real sites.
 
 """
 import pytest
+import subprocess
+import sys
 
 from .. import version_info
+
+
+# Modules that the CLI entrypoint must not pull in at startup. The network
+# stack is only loaded by the subcommands that need it.
+LAZY_MODULES = frozenset(['requests', 'urllib3', 'url_normalize', 'yaml'])
+
+# Generous, since CI machines are slow and noisy; importing `requests` alone
+# typically blows well through this.
+IMPORT_BUDGET_USEC = 100000
+
+
+def test_cli_import_time():
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import wwt_url_database.cli'],
+        stdout = subprocess.PIPE,
+        stderr = subprocess.PIPE,
+        check = True,
+        universal_newlines = True,
+    )
+
+    imported = set()
+    cumulative = None
+
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+
+        pieces = line.split('|')
+        if len(pieces) != 3:
+            continue
+
+        try:
+            cum_usec = int(pieces[1])
+        except ValueError:
+            continue  # the header line
+
+        name = pieces[2].strip()
+        imported.add(name)
+
+        if name == 'wwt_url_database.cli':
+            cumulative = cum_usec
+
+    assert not (imported & LAZY_MODULES), 'eagerly imported: ' + ', '.join(sorted(imported & LAZY_MODULES))
+    assert cumulative is not None
+    assert cumulative < IMPORT_BUDGET_USEC
+
+
+def test_parse_log_lines():
+    from ..coverage import parse_log_lines
+
+    lines = [
+        '#Fields: date time cs-uri-stem cs-uri-query cs(Host) sc-status',
+        '2020-01-01 00:00:00 /about - worldwidetelescope.org 200',
+        '2020-01-01 00:00:00 /wwtweb/x.aspx a=1 - 404',
+        '#Software: something else',
+        '#Fields: date c-ip',
+        '1.2.3.4 - - [10/Oct/2000:13:55:36 -0700] "GET /a?b=c HTTP/1.0" 200 2326 "-" "ua"',
+    ]
+
+    assert list(parse_log_lines(lines)) == [
+        ('worldwidetelescope.org', '/about', '200'),
+        (None, '/wwtweb/x.aspx?a=1', '404'),
+        (None, '/a?b=c', '200'),
+    ]
+
+
+def test_normalize_many():
+    from .. import Database
+
+    db = Database()
+    urls = [rec.url() for rec in db.get_records()]
+    urls += ['http://www.worldwidetelescope.org/about#frag', 'http://nonexistent.example.com/']
+
+    expected = [db.normalize(u) for u in urls[:-1]] + [None]
+    assert list(db.normalize_many(urls, strict=False)) == expected
+
+    with pytest.raises(Exception):
+        list(db.normalize_many(urls))
+
+
+def test_index_roundtrip(tmpdir):
+    from .. import Database
+    from ..index import UrlIndex, write_index
+
+    db = Database()
+    path = str(tmpdir.join('urls.idx'))
+    write_index(db, path)
+    n = 0
+
+    with UrlIndex(path) as index:
+        for domain in db.domains():
+            for rec in domain.records():
+                n += 1
+                entry = index.lookup(rec.url())
+                assert entry is not None
+                assert entry.content_type == rec.content_type
+                assert entry.categories == rec.categories
+                assert entry.content_length == rec.content_length
+
+        assert len(index) == n
+        assert index.lookup('http://worldwidetelescope.org/not/a/real/path') is None
+        assert index.lookup('http://nonexistent.example.com/') is None
+
+
+def test_bulk_roundtrip(tmpdir):
+    import io
+    import os
+    from .. import Database
+    from ..bulk import import_items, iter_items, read_items, write_items
+
+    db = Database()
+    buf = io.BytesIO()
+    write_items(iter_items(db), buf)
+    buf.seek(0)
+
+    dbdir = str(tmpdir.mkdir('db'))
+    import_items(Database(dbdir), read_items(buf))
+
+    for entry in os.listdir(db._dbdir):
+        with open(os.path.join(db._dbdir, entry), 'rt') as f:
+            orig = f.read()
+
+        with open(os.path.join(dbdir, entry), 'rt') as f:
+            assert f.read() == orig
+
+
+def test_lint_database():
+    import os.path
+    from .. import Database
+    from ..lint import lint_files
+
+    db = Database()
+    paths = [os.path.join(db._dbdir, d + '.yaml') for d in db._domains]
+    assert lint_files(paths, processes=1) == []
+
+
+def test_content_sample_coverage():
+    import datetime
+    from .. import Database
+    from ..planning import ContentSampler
+
+    records = list(Database().get_records())
+    start = datetime.date(2020, 1, 1)
+
+    for num, denom in [(1, 7), (3, 7), (2, 2)]:
+        seen = set()
+
+        for day in range(-(-denom // num)):
+            sampler = ContentSampler(num, denom, run_date=start + datetime.timedelta(days=day))
+            seen.update(id(r) for r in records if sampler.selected(r))
+
+        assert len(seen) == len(records)
+
+
+def _write_recording(recdir, url, status=200, headers=None, body=b'', range=None):
+    """Record a response in the format used by the replay adapter."""
+    import hashlib
+    import json
+    import requests
+    from ..replay import _request_key
+
+    req_headers = {} if range is None else {'Range': range}
+    key = _request_key(requests.Request('GET', url, headers=req_headers).prepare())
+    recdir.join(key + '.body').write_binary(body)
+    recdir.join(key + '.json').write(json.dumps({
+        'body': True,
+        'headers': headers or {},
+        'length': len(body),
+        'reason': 'OK',
+        'sha256': hashlib.sha256(body).hexdigest(),
+        'status': status,
+    }))
+
+
+def test_replay_check(tmpdir):
+    import hashlib
+    import json
+    import requests
+    from .. import Database
+    from ..replay import _request_key, install_replayer
+
+    body = b'hello world\n'
+    dbdir = tmpdir.mkdir('db')
+    dbdir.join('example.com.yaml').write(
+        '---\n'
+        '---\n'
+        '_path: /hello.txt\n'
+        'content-blake2b: %s\n'
+        'content-length: %d\n'
+        'content-sha256: %s\n'
+        'content-type: text/plain\n' % (
+            hashlib.blake2b(body, digest_size=32).hexdigest(),
+            len(body),
+            hashlib.sha256(body).hexdigest(),
+        )
+    )
+
+    recdir = tmpdir.mkdir('rec')
+    url = 'http://example.com/hello.txt'
+    key = _request_key(requests.Request('GET', url).prepare())
+    recdir.join(key + '.body').write_binary(body)
+    recdir.join(key + '.json').write(json.dumps({
+        'body': True,
+        'headers': {'Content-Type': 'text/plain'},
+        'length': len(body),
+        'reason': 'OK',
+        'sha256': hashlib.sha256(body).hexdigest(),
+        'status': 200,
+    }))
+
+    session = requests.Session()
+    install_replayer(session, str(recdir))
+    db = Database(str(dbdir))
+    rec = next(db.get_records())
+    assert not rec.check(session)
+
+    seen = []
+    results = list(db.check_records(None, session, concurrency=2, callback=seen.append))
+    assert seen == results
+    assert [(r.url, r.problem, r.content_verified) for r in results] == [(url, None, True)]
+
+    rec.content_sha256 = b'\0' * 32
+    assert rec.check(session)
+    assert not rec.check(session, fast_digest=True)
+
+
+def test_shared_snapshot(tmpdir):
+    from .. import Database, Record
+    from ..snapshot import SharedSnapshot
+
+    tmpdir.join('example.com.yaml').write(
+        '--- {}\n'
+        '---\n'
+        '_path: /\n'
+        'content-type: text/html\n'
+    )
+
+    shared = SharedSnapshot(str(tmpdir))
+    old = shared.current
+    assert len(old) == 1
+    assert old.get_record('http://example.com/').content_type == 'text/html'
+    assert old.get_record('http://example.com/new') is None
+    assert not shared.reload()
+
+    db = Database(str(tmpdir))
+    dname, path = db.normalize('http://example.com/new')
+
+    with db.transaction() as txn:
+        txn.insert(Record(db._get_domain(dname), {'_path': path, 'content-type': 'text/plain'}))
+
+    assert old.is_stale()
+    assert shared.reload()
+    assert shared.current.get_record('http://example.com/new').content_type == 'text/plain'
+    assert old.get_record('http://example.com/new') is None
+
+
+def test_content_index(tmpdir):
+    from .. import Database
+    from ..mirrors import ContentIndex
+
+    a = 'a' * 64
+    b = 'b' * 64
+
+    for dname, digests in [('one.example.com', [a, b]), ('two.example.com', [a])]:
+        text = '--- {}\n'
+
+        for i, digest in enumerate(digests):
+            text += f'---\n_path: /f{i}\ncontent-length: 100\ncontent-sha256: {digest}\ncontent-type: image/png\n'
+
+        text += '---\n_path: /page\ncontent-type: text/html\n'
+        tmpdir.join(dname + '.yaml').write(text)
+
+    index = ContentIndex(Database(str(tmpdir)).get_records())
+    assert len(index) == 2
+    assert [r.url() for r in index.lookup(bytes.fromhex(a))] == [
+        'http://one.example.com/f0',
+        'http://two.example.com/f0',
+    ]
+
+    groups = index.groups()
+    assert len(groups) == 1
+    assert groups[0].sha256 == bytes.fromhex(a)
+
+    primaries, duplicates = index.split()
+    assert sorted(r.url() for r in primaries) == ['http://one.example.com/f0', 'http://one.example.com/f1']
+    assert [r.url() for r in duplicates] == ['http://two.example.com/f0']
+
+
+def test_verify_mirror(tmpdir):
+    import hashlib
+    from .. import Database
+    from ..localmirror import verify_mirror
+
+    files = {'/data/a.bin': b'alpha', '/data/b.bin': b'bravo', '/data/c.bin': b'charlie', '/d.bin': b'delta'}
+    text = '---\ncase-sensitive-paths: false\n'
+
+    for path, data in sorted(files.items()):
+        text += f'---\n_path: {path}\ncontent-length: {len(data)}\n'
+        text += f'content-sha256: {hashlib.sha256(data).hexdigest()}\ncontent-type: application/octet-stream\n'
+
+    dbdir = tmpdir.mkdir('db')
+    dbdir.join('example.com.yaml').write(text)
+
+    mirror = tmpdir.mkdir('mirror').mkdir('example.com')
+    mirror.mkdir('Data').join('A.bin').write_binary(b'alpha')
+    mirror.join('Data', 'b.bin').write_binary(b'bravO')
+    mirror.join('Data', 'c.bin').write_binary(b'charli')
+
+    # Encoded separators mustn't let a path escape the mirror.
+    escape = '/data%2F..%2F..%2F..%2Fsecret.bin'
+    digest = hashlib.sha256(b'secret').hexdigest()
+    text += f'---\n_path: {escape}\ncontent-length: 6\n'
+    text += f'content-sha256: {digest}\ncontent-type: application/octet-stream\n'
+    dbdir.join('example.com.yaml').write(text)
+    tmpdir.join('secret.bin').write_binary(b'secret')
+
+    results = verify_mirror(Database(str(dbdir)).get_records(), str(tmpdir.join('mirror')), processes=1)
+    statuses = {r.record.path: r.status for r in results}
+    assert statuses == {
+        '/data/a.bin': 'ok',
+        '/data/b.bin': 'corrupted',
+        '/data/c.bin': 'resized',
+        '/d.bin': 'missing',
+        escape: 'unmappable',
+    }
+
+
+def test_wtml_extract_urls():
+    import io
+    from ..wtml import extract_urls
+
+    wtml = b'''<?xml version="1.0" encoding="utf-8"?>
+<Folder Name="Test" Thumbnail="http://example.com/folder.jpg">
+  <Place Name="M51" RA="13.5" Dec="47.2">
+    <ForegroundImageSet>
+      <ImageSet Url="http://example.com/tiles/{1}/{3}/{3}_{2}.png" DemUrl="">
+        <ThumbnailUrl>
+          http://example.com/m51.jpg
+        </ThumbnailUrl>
+        <Credits>Somebody</Credits>
+        <CreditsUrl>https://example.org/credits</CreditsUrl>
+      </ImageSet>
+    </ForegroundImageSet>
+  </Place>
+</Folder>'''
+
+    assert list(extract_urls(io.BytesIO(wtml))) == [
+        'http://example.com/m51.jpg',
+        'https://example.org/credits',
+        'http://example.com/folder.jpg',
+    ]
+
+
+def test_order_longest_first():
+    from types import SimpleNamespace
+    from ..planning import order_longest_first
+
+    domain = SimpleNamespace(_domain='example.com')
+
+    def rec(path, length=None):
+        return SimpleNamespace(_domain=domain, path=path, content_length=length)
+
+    page, slow_page, small, big = rec('/page'), rec('/slow'), rec('/small', 10**5), rec('/big', 10**9)
+    records = [page, slow_page, small, big]
+
+    order = order_longest_first(records, verify=lambda r: True)
+    assert order[:2] == [big, small]
+
+    # 1 GB at 10 MB/s takes 100 s, which a 200-second page outlasts.
+    timings = {
+        'example.com/slow': {'elapsed': 200., 'bytes': 0},
+        'example.com/x': {'elapsed': 1.1, 'bytes': 10**7},
+    }
+    order = order_longest_first(records, verify=lambda r: True, timings=timings)
+    assert order[:2] == [slow_page, big]
+
+    order = order_longest_first(records, timings=timings)
+    assert order[0] is slow_page
+
+
+def test_dns_cache(monkeypatch):
+    import socket
+    from ..net import DNSCache
+
+    calls = []
+
+    def fake_getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+        calls.append(host)
+        if host == 'bad.example.com':
+            raise socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('192.0.2.1', port))]
+
+    monkeypatch.setattr(socket, 'getaddrinfo', fake_getaddrinfo)
+
+    with DNSCache(ttl=60) as cache:
+        for _ in range(3):
+            assert socket.getaddrinfo('example.com', 80)[0][4] == ('192.0.2.1', 80)
+
+            with pytest.raises(socket.gaierror):
+                socket.getaddrinfo('bad.example.com', 80)
+
+    assert calls == ['example.com', 'bad.example.com']
+    assert (cache.hits, cache.misses) == (4, 2)
+    assert socket.getaddrinfo is fake_getaddrinfo
+
+
+def test_extract_links():
+    from ..discover import extract_links
+
+    html = '''<html><head><base href="/sub/"></head><body>
+<a href="page.html#frag">x</a> <img src=" /img.png ">
+<a href="https://other.org/a">y</a> <a href="mailto:someone@example.com">z</a>
+<a href="http://[bogus/">bad</a> <a name="anchor">no link</a>
+</body></html>'''
+
+    assert extract_links(html, 'http://example.com/index.html') == [
+        'http://example.com/sub/page.html',
+        'http://example.com/img.png',
+        'https://other.org/a',
+    ]
+
+
+def test_crawler_survives_broken_pages(tmpdir):
+    import io
+    import requests
+    from requests.adapters import BaseAdapter
+    from requests.models import Response
+    from requests.structures import CaseInsensitiveDict
+    from .. import Database
+    from ..discover import Crawler
+
+    tmpdir.join('example.com.yaml').write(
+        '--- {}\n'
+        '---\n'
+        '_path: /\n'
+        'content-type: text/html\n'
+        '---\n'
+        '_path: /broken.html\n'
+        'content-type: text/html\n'
+    )
+
+    pages = {
+        '/': b'<a href="/broken.html">a</a> <a href="/new.html">b</a> <a href="http://other.org/">c</a>',
+        '/new.html': b'<a href="/newer.html">d</a> <a href="/">e</a>',
+    }
+
+    class TruncatedBody(object):
+        def read(self, *args, **kwargs):
+            raise requests.exceptions.ChunkedEncodingError('IncompleteRead')
+
+        def close(self):
+            pass
+
+    class FakeAdapter(BaseAdapter):
+        def send(self, request, **kwargs):
+            path = request.path_url
+            resp = Response()
+            resp.status_code = 200
+            resp.url = request.url
+            resp.request = request
+            resp.headers = CaseInsensitiveDict({'Content-Type': 'text/html'})
+            resp.raw = io.BytesIO(pages[path]) if path in pages else TruncatedBody()
+            return resp
+
+        def close(self):
+            pass
+
+    crawler = Crawler(Database(str(tmpdir)), max_depth=2, concurrency=2)
+    crawler._session.mount('http://', FakeAdapter())
+    candidates = crawler.crawl(Database(str(tmpdir)).get_records())
+
+    assert [(c.path, c.referrers) for c in candidates] == [('/new.html', 1), ('/newer.html', 1)]
+    assert [url for url, _ in crawler.errors] == ['http://example.com/broken.html', 'http://example.com/newer.html']
+    assert 'IncompleteRead' in crawler.errors[0][1]
+
+
+def test_changed_records(tmpdir):
+    from .. import Database
+    from ..bulk import iter_items, write_items
+    from ..changes import changed_records, load_snapshot
+
+    # The old state has the categories in flow style and the keys in a
+    # different order; that alone shouldn't count as a change.
+    old = tmpdir.mkdir('old')
+    old.join('example.com.yaml').write(
+        '--- {}\n'
+        '---\n'
+        '_path: /a\n'
+        'content-type: text/html\n'
+        '---\n'
+        'categories: [y, x]\n'
+        'content-type: text/plain\n'
+        '_path: /b\n'
+        '---\n'
+        '_path: /c\n'
+        'content-type: text/html\n'
+    )
+
+    export = str(tmpdir.join('old.jsonl'))
+    with open(export, 'wb') as f:
+        write_items(iter_items(Database(str(old))), f)
+
+    new = tmpdir.mkdir('new')
+    new.join('example.com.yaml').write(
+        '--- {}\n'
+        '---\n'
+        '_path: /a\n'
+        'content-type: text/html\n'
+        '---\n'
+        '_path: /b\n'
+        'categories:\n'
+        '- x\n'
+        '- y\n'
+        'content-type: text/plain\n'
+        '---\n'
+        '_path: /c\n'
+        'content-type: text/plain\n'
+        '---\n'
+        '_path: /d\n'
+        'content-type: text/html\n'
+    )
+
+    db = Database(str(new))
+
+    for snapshot in (str(old), export):
+        changed = changed_records(db, load_snapshot(snapshot))
+        assert [rec.path for rec in changed] == ['/c', '/d']
+
+
+def test_check_redirects(tmpdir):
+    import requests
+    from .. import Database, RedirectCache
+    from ..replay import install_replayer
+
+    dbdir = tmpdir.mkdir('db')
+    dbdir.join('example.com.yaml').write(
+        '--- {}\n'
+        '---\n'
+        '_path: /also\n'
+        'content-type: X-302-Redirect\n'
+        '---\n'
+        '_path: /moved\n'
+        'content-type: X-301-Redirect\n'
+        'redirect-target: http://example.com/new\n'
+        '---\n'
+        '_path: /old\n'
+        'content-type: X-302-Redirect\n'
+        'redirect-target: http://example.com/new\n'
+    )
+
+    recdir = tmpdir.mkdir('rec')
+
+    for host in ('example.com', 'proto.example.com'):
+        new = f'http://{host}/new'
+        _write_recording(recdir, f'http://{host}/old', 302, {'Location': new})
+        _write_recording(recdir, f'http://{host}/also', 302, {'Location': new})
+        _write_recording(recdir, f'http://{host}/moved', 301, {'Location': '/elsewhere'})
+        _write_recording(recdir, new, 200, {'Content-Type': 'text/html'})
+
+    session = requests.Session()
+    install_replayer(session, str(recdir))
+    fetched = []
+    get = session.get
+
+    def counting_get(url, **kwargs):
+        fetched.append(url)
+        return get(url, **kwargs)
+
+    session.get = counting_get
+
+    def problems(db):
+        redirects = RedirectCache()
+        results = db.check_records(None, session, concurrency=1, redirects=redirects)
+        return {r.record.path: r.problem for r in results}
+
+    assert problems(Database(str(dbdir))) == {
+        '/also': None,
+        '/moved': 'expected redirect to http://example.com/new; got http://example.com/elsewhere',
+        '/old': None,
+    }
+    assert fetched.count('http://example.com/new') == 1
+
+    # When checking a prototype site, its redirects should stay on it.
+    db = Database(str(dbdir))
+    db.activate_map('example.com', 'proto.example.com')
+    assert problems(db)['/old'] is None
+    _, rec, _ = db.get_record('http://example.com/old')
+    assert rec._mapped_redirect_target() == 'http://proto.example.com/new'
+
+
+def test_transaction(tmpdir):
+    from .. import Database, Record
+    from ..transaction import TransactionError
+
+    one = tmpdir.join('one.example.com.yaml')
+    one.write(
+        '--- {}\n'
+        '---\n'
+        '_path: /a\n'
+        'categories:\n'
+        '- x\n'
+        'content-type: text/html\n'
+        '---\n'
+        '_path: /b\n'
+        'content-type: text/html\n'
+    )
+    two = tmpdir.join('two.example.com.yaml')
+    two.write('--- {}\n---\n_path: /\ncontent-type: text/html\n')
+
+    db = Database(str(tmpdir))
+
+    def paths(dname):
+        return {rec.path: rec.categories for rec in db._get_domain(dname).records()}
+
+    with db.transaction() as txn:
+        txn.add_categories('http://one.example.com/a', 'y', 'z')
+        txn.remove_categories('http://one.example.com/a', 'x', 'z')
+        txn.delete('http://one.example.com/b')
+        txn.insert(Record(db._get_domain('two.example.com'), {'_path': '/new', 'content-type': 'text/plain'}))
+        assert len(txn) == 4
+        assert txn.touched_domains() == ['one.example.com', 'two.example.com']
+
+    assert paths('one.example.com') == {'/a': {'y'}}
+    assert paths('two.example.com') == {'/': set(), '/new': set()}
+
+    # A change that can't be applied aborts the whole commit, even in domains
+    # that come earlier.
+    before = (one.read(), two.read())
+
+    for stage in [
+        lambda txn: txn.insert(Record(db._get_domain('two.example.com'), {'_path': '/', 'content-type': 'x/y'}),
+                               replace=False),
+        lambda txn: txn.delete('http://two.example.com/missing'),
+        lambda txn: txn.add_categories('http://two.example.com/missing', 'x'),
+    ]:
+        with pytest.raises(TransactionError):
+            with db.transaction() as txn:
+                txn.delete('http://one.example.com/a')
+                stage(txn)
+
+        assert (one.read(), two.read()) == before
+
+
+def test_transaction_locking(tmpdir):
+    import threading
+    from .. import Database, Record
+    from ..transaction import locked_domain
+
+    tmpdir.join('example.com.yaml').write('--- {}\n---\n_path: /\ncontent-type: text/html\n')
+    db = Database(str(tmpdir))
+    domain = db._get_domain('example.com')
+    rec = Record(domain, {'_path': '/new', 'content-type': 'text/plain'})
+
+    # insert_record should go through a transaction, and so wait for the lock.
+    with locked_domain(db, 'example.com'):
+        writer = threading.Thread(target=domain.insert_record, args=(rec,))
+        writer.start()
+        writer.join(0.5)
+        assert writer.is_alive()
+        assert [r.path for r in domain.records()] == ['/']
+
+    writer.join()
+    assert [r.path for r in domain.records()] == ['/', '/new']
+
+
+def test_rebaseline(tmpdir, monkeypatch, capsys):
+    import hashlib
+    import requests
+    from .. import Database, cli, net
+    from ..replay import install_replayer
+
+    same, new = b'unchanged\n', b'new content\n'
+    dbdir = tmpdir.mkdir('db')
+    dbfile = dbdir.join('example.com.yaml')
+    dbfile.write(
+        '--- {}\n'
+        '---\n'
+        f'_path: /changed.bin\ncontent-length: 3\ncontent-sha256: {"ab" * 32}\n'
+        'content-type: application/octet-stream\n'
+        '---\n'
+        f'_path: /same.bin\ncontent-length: {len(same)}\ncontent-sha256: {hashlib.sha256(same).hexdigest()}\n'
+        'content-type: application/octet-stream\n'
+    )
+
+    recdir = tmpdir.mkdir('rec')
+    _write_recording(recdir, 'http://example.com/same.bin', headers={'Content-Type': 'application/octet-stream'},
+                     body=same)
+    _write_recording(recdir, 'http://example.com/changed.bin', headers={'Content-Type': 'application/octet-stream'},
+                     body=new)
+
+    def make_session(**kwargs):
+        session = requests.Session()
+        install_replayer(session, str(recdir))
+        return session
+
+    monkeypatch.setattr(cli, 'Database', lambda: Database(str(dbdir)))
+    monkeypatch.setattr(net, 'make_session', make_session)
+    before = dbfile.read()
+
+    monkeypatch.setattr('sys.argv', ['wwturldb', 'rebaseline', '--dry-run'])
+    cli.entrypoint()
+    out = capsys.readouterr().out
+    assert 'http://example.com/changed.bin\n  content-length: 3 => 12\n' in out
+    assert 'same.bin' not in out
+    assert out.endswith('1 of 2 static records changed\n')
+    assert dbfile.read() == before
+
+    monkeypatch.setattr('sys.argv', ['wwturldb', 'rebaseline'])
+    cli.entrypoint()
+    records = {rec.path: rec for rec in Database(str(dbdir)).get_records()}
+    assert records['/changed.bin'].content_length == len(new)
+    assert records['/changed.bin'].content_sha256 == hashlib.sha256(new).digest()
+    assert records['/same.bin'].content_sha256 == hashlib.sha256(same).digest()
+
+
+def test_plan_content_budget():
+    from types import SimpleNamespace
+    from ..planning import plan_content_budget
+
+    domain = SimpleNamespace(_domain='example.com')
+
+    def rec(path, length, *categories):
+        return SimpleNamespace(_domain=domain, path=path, content_length=length, categories=set(categories))
+
+    old, recent, never, big = rec('/old', 30), rec('/recent', 10), rec('/never', 50), rec('/big', 80)
+    vital = rec('/vital', 40, 'frontend')
+    history = {'example.com/old': '2020-01-01', 'example.com/recent': '2020-03-01', 'example.com/vital': '2020-03-01'}
+    records = [old, recent, never, big, vital]
+
+    # Priority first, then never-verified (smaller first), then the least
+    # recently verified. /big doesn't fit after /never, but /old still does.
+    selected, planned = plan_content_budget(records, 125, history=history, priority_categories=['frontend'])
+    assert selected == [vital, never, old]
+    assert planned == 120
+
+    selected, planned = plan_content_budget(records, 100, history=history)
+    assert selected == [never, old, recent]
+    assert planned == 90
+
+
+def test_check_chunk_sample_accounting(tmpdir, monkeypatch, capsys):
+    import hashlib
+    import json
+    from .. import Database, cli
+
+    body = b'abcdefgh'
+    chunks = [hashlib.sha256(body[:4]).hexdigest(), hashlib.sha256(body[4:]).hexdigest()]
+    dbdir = tmpdir.mkdir('db')
+    dbdir.join('example.com.yaml').write(
+        '--- {}\n'
+        '---\n'
+        f'_path: /big.bin\ncontent-chunk-sha256:\n- {chunks[0]}\n- {chunks[1]}\ncontent-chunk-size: 4\n'
+        f'content-length: 8\ncontent-sha256: {hashlib.sha256(body).hexdigest()}\n'
+        'content-type: application/octet-stream\n'
+        '---\n'
+        f'_path: /small.bin\ncontent-length: 3\ncontent-sha256: {hashlib.sha256(b"abc").hexdigest()}\n'
+        'content-type: application/octet-stream\n'
+    )
+
+    recdir = tmpdir.mkdir('rec')
+    headers = {'Content-Type': 'application/octet-stream'}
+    _write_recording(recdir, 'http://example.com/big.bin', headers=headers, body=body)
+    _write_recording(recdir, 'http://example.com/big.bin', 206, headers, body[:4], range='bytes=0-3')
+    _write_recording(recdir, 'http://example.com/big.bin', 206, headers, body[4:], range='bytes=4-7')
+    _write_recording(recdir, 'http://example.com/small.bin', headers=headers, body=b'abc')
+
+    history = str(tmpdir.join('history.json'))
+    timings = str(tmpdir.join('timings.json'))
+    monkeypatch.setattr(cli, 'Database', lambda: Database(str(dbdir)))
+    monkeypatch.setattr('sys.argv', [
+        'wwturldb', 'check', '--replay', str(recdir), '--chunk-sample', '1', '--max-bytes', '1K',
+        '--history', history, '--timings', timings, '--run-date', '2020-01-02', '--dns-ttl', '0',
+    ])
+    cli.entrypoint()
+
+    # Only the sampled chunk counts as downloaded, and sampling doesn't count
+    # as a full verification for the history.
+    assert 'planned 11 of 1024 budgeted bytes; 7 bytes verified' in capsys.readouterr().out
+
+    with open(history) as f:
+        assert json.load(f) == {'example.com/small.bin': '2020-01-02'}
+
+    with open(timings) as f:
+        assert {k: v['bytes'] for k, v in json.load(f).items()} == {
+            'example.com/big.bin': 4,
+            'example.com/small.bin': 3,
+        }
+
+
+def test_compare(tmpdir):
+    import hashlib
+    import requests
+    from .. import Database
+    from ..compare import Fetched, _differences, compare_records
+    from ..replay import install_replayer
+
+    dbdir = tmpdir.mkdir('db')
+    dbdir.join('example.com.yaml').write(
+        '--- {}\n'
+        '---\n'
+        f'_path: /data.bin\ncontent-length: 4\ncontent-sha256: {hashlib.sha256(b"data").hexdigest()}\n'
+        'content-type: application/octet-stream\n'
+        '---\n'
+        '_path: /page\n'
+        'content-type: text/html\n'
+        '---\n'
+        '_path: /redir\n'
+        'content-type: X-302-Redirect\n'
+    )
+
+    recdir = tmpdir.mkdir('rec')
+
+    for host in ('example.com', 'proto.example.com'):
+        _write_recording(recdir, f'http://{host}/data.bin', headers={'Content-Type': 'application/octet-stream'},
+                         body=b'data')
+        _write_recording(recdir, f'http://{host}/page', headers={'Content-Type': 'text/html'},
+                         body=f'<p>Served by {host}</p>'.encode('utf-8'))
+        _write_recording(recdir, f'http://{host}/redir', 302, {'Location': f'http://{host}/target'})
+
+    session = requests.Session()
+    install_replayer(session, str(recdir))
+    db = Database(str(dbdir))
+    db.activate_map('example.com', 'proto.example.com')
+
+    # The redirect targets only differ by the mapping, which is expected.
+    comps = {c.record.path: c for c in compare_records(db, db.get_records(), session)}
+    assert {path: c.differences for path, c in comps.items()} == {
+        '/data.bin': [],
+        '/page': ['content-length: 28 vs. 34'],
+        '/redir': [],
+    }
+
+    comps = {c.record.path: c for c in compare_records(db, db.get_records(), session, compare_dynamic=False)}
+    assert all(not c.differences for c in comps.values())
+    assert comps['/page'].original.length is None
+    assert comps['/page'].original.sha256 is None
+    assert comps['/data.bin'].alias.sha256 == hashlib.sha256(b'data').digest()
+
+    # A redirect from the prototype back to the original domain is a problem.
+    rec = comps['/redir'].record
+    orig = Fetched(302, None, 0, None, 'http://example.com/target', None)
+    alias = orig._replace(location='http://example.com/target')
+    assert _differences(rec, orig, alias, True) == [
+        'redirect: http://example.com/target vs. http://example.com/target',
+    ]
+    alias = orig._replace(location='http://proto.example.com/target', status=301)
+    assert _differences(rec, orig, alias, True) == ['status: 302 vs. 301']
+
+
+def test_content_chunks():
+    import hashlib
+    from .. import _ContentDigester, _describe_chunks
+
+    data = bytes(range(256)) * 40
+
+    class FakeResponse(object):
+        def iter_content(self, chunk_size=None):
+            # Pieces that straddle chunk boundaries in various ways.
+            for start, end in [(0, 1), (1, 999), (999, 2500), (2500, 2500), (2500, 10240)]:
+                yield data[start:end]
+
+    d = _ContentDigester(chunk_size=1000, blake2b=True).consume(FakeResponse())
+    assert d.length == len(data)
+    assert d.sha256 == hashlib.sha256(data).digest()
+    assert d.blake2b == hashlib.blake2b(data, digest_size=32).digest()
+    assert d.chunk_sha256 == [hashlib.sha256(data[i:i + 1000]).digest() for i in range(0, len(data), 1000)]
+    assert len(d.chunk_sha256) == 11
+
+    assert _describe_chunks([], 1000, 10240) == ''
+    assert _describe_chunks([0, 1, 3, 10], 1000, 10240) == '0-1999, 3000-3999, 10000-10239'
+    assert _describe_chunks([0, 2, 4, 6, 8, 10], 1000, 10240) == \
+        '0-999, 2000-2999, 4000-4999, 6000-6999, 8000-8999, and 1 more ranges'
+
+
+def test_verify_chunk_sample(tmpdir):
+    import hashlib
+    import requests
+    from .. import Database
+    from ..replay import install_replayer
+
+    body = b'0123456789'
+    chunks = [hashlib.sha256(body[i:i + 4]).hexdigest() for i in (0, 4, 8)]
+    dbdir = tmpdir.mkdir('db')
+    dbdir.join('example.com.yaml').write(
+        '--- {}\n'
+        '---\n'
+        f'_path: /f.bin\ncontent-chunk-sha256:\n- {chunks[0]}\n- {chunks[1]}\n- {chunks[2]}\n'
+        f'content-chunk-size: 4\ncontent-length: 10\ncontent-sha256: {hashlib.sha256(body).hexdigest()}\n'
+        'content-type: application/octet-stream\n'
+    )
+    rec = next(Database(str(dbdir)).get_records())
+    url = 'http://example.com/f.bin'
+
+    def verify(responses, n_chunks=3):
+        recdir = tmpdir.mkdtemp()
+        for rng, status, data in responses:
+            _write_recording(recdir, url, status, body=data, range=rng)
+
+        session = requests.Session()
+        install_replayer(session, str(recdir))
+        return rec._verify_chunk_sample(session, url, n_chunks)
+
+    ranges = ['bytes=0-3', 'bytes=4-7', 'bytes=8-9']
+    assert verify([(r, 206, body[i:i + 4]) for r, i in zip(ranges, (0, 4, 8))]) == (None, 10)
+    assert verify([(r, 206, b'XY' if i == 8 else body[i:i + 4]) for r, i in zip(ranges, (0, 4, 8))]) == \
+        ('content changed in bytes 8-9', 10)
+
+    # Servers that ignore Range get the whole body verified instead.
+    assert verify([(r, 200, body) for r in ranges], n_chunks=1) == (None, 10)
+    assert verify([(r, 416, b'') for r in ranges], n_chunks=1) == ('HTTP 416 for range request', 0)
+
+
+def test_record_replay_chunk_sample(tmpdir):
+    import datetime
+    import hashlib
+    import http.server
+    import threading
+    import requests
+    from .. import Database
+    from ..replay import install_recorder, install_replayer
+
+    body = bytes(range(256)) * 4
+    chunks = ''.join(f'- {hashlib.sha256(body[i:i + 64]).hexdigest()}\n' for i in range(0, len(body), 64))
+    dbdir = tmpdir.mkdir('db')
+    dbdir.join('example.com.yaml').write(
+        '--- {}\n'
+        '---\n'
+        f'_path: /f.bin\ncontent-chunk-sha256:\n{chunks}content-chunk-size: 64\n'
+        f'content-length: {len(body)}\ncontent-sha256: {hashlib.sha256(body).hexdigest()}\n'
+        'content-type: application/octet-stream\n'
+    )
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            data = body
+            rng = self.headers.get('Range')
+
+            if rng is None:
+                self.send_response(200)
+            else:
+                start, end = (int(x) for x in rng[len('bytes='):].split('-'))
+                data = body[start:end + 1]
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{end}/{len(body)}')
+
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    recdir = str(tmpdir.join('rec'))
+    run_date = datetime.date(2020, 1, 2)
+
+    def check(install):
+        db = Database(str(dbdir))
+        db.activate_map('example.com', f'127.0.0.1:{server.server_address[1]}')
+        session = requests.Session()
+        install(session, recdir)
+        results = list(db.check_records(None, session, chunk_sample=3, run_date=run_date))
+        return [(r.problem, r.content_verified, r.content_bytes) for r in results]
+
+    try:
+        assert check(install_recorder) == [(None, True, 192)]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # The server is gone, so this only works if the same chunks are requested.
+    for _ in range(3):
+        assert check(install_replayer) == [(None, True, 192)]
+
+
+def test_snapshot_deprecated():
+    from .. import Database
+    from ..snapshot import Snapshot
+
+    db = Database()
+    url = 'http://worldwidetelescope.org/HTML5TourPlayer.aspx'
+    _, rec, existed = db.get_record(url)
+    assert existed and 'deprecated' in rec.categories
+
+    for processes in (None, 2):
+        snap = Snapshot(db, processes=processes)
+        frec = snap.get_record(url)
+        assert frec is not None
+        assert 'deprecated' in frec.categories
+        assert frec not in snap.records()
+        assert len(list(snap.records())) == len(list(db.get_records()))
+
+
+def test_record_replay_header_check(tmpdir):
+    import gzip
+    import hashlib
+    import http.server
+    import json
+    import threading
+    import requests
+    from .. import Database
+    from ..replay import install_recorder, install_replayer
+
+    body = b'compressible ' * 100
+    text = '--- {}\n'
+
+    for path, length in [('/gzipped.txt', len(body)), ('/plain.txt', len(body)), ('/resized.txt', len(body) + 1)]:
+        text += f'---\n_path: {path}\ncontent-length: {length}\n'
+        text += f'content-sha256: {hashlib.sha256(body).hexdigest()}\ncontent-type: text/plain\n'
+
+    dbdir = tmpdir.mkdir('db')
+    dbdir.join('example.com.yaml').write(text)
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            data = body
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain')
+
+            if self.path == '/gzipped.txt':
+                data = gzip.compress(body)
+                self.send_header('Content-Encoding', 'gzip')
+
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def check(install, recdir, content=False):
+        db = Database(str(dbdir))
+        db.activate_map('example.com', f'127.0.0.1:{server.server_address[1]}')
+        session = requests.Session()
+        install(session, str(recdir))
+        results = db.check_records(None, session, content=content, header_check=True)
+        return {r.record.path: r.problem for r in results}
+
+    expected = {
+        '/gzipped.txt': None,
+        '/plain.txt': None,
+        '/resized.txt': f'Content-Length header changed from {len(body) + 1} to {len(body)}',
+    }
+    headers_only = tmpdir.join('headers')
+    full = tmpdir.join('full')
+
+    try:
+        assert check(install_recorder, headers_only) == expected
+        assert check(install_recorder, full, content=True)['/resized.txt'].startswith('content length changed')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # Bodies that weren't read aren't recorded, and the headers are kept as
+    # served, so a replayed header check behaves as the live one did.
+    for path in headers_only.listdir('*.json'):
+        info = json.loads(path.read())
+        assert not info['complete'] and 'length' not in info
+
+    assert check(install_replayer, headers_only) == expected
+    assert 'was not recorded' in check(install_replayer, headers_only, content=True)['/plain.txt']
+
+    # Bodies that were read are recorded decoded, with a Content-Length to
+    # match.
+    for path in full.listdir('*.json'):
+        info = json.loads(path.read())
+        assert info['complete']
+        assert 'content-encoding' not in {k.lower() for k in info['headers']}
+        assert info['headers']['Content-Length'] == str(info['length'])
+
+    assert check(install_replayer, full) == expected
+    assert check(install_replayer, full, content=True)['/gzipped.txt'] is None
+
+
+def test_bulk_import_failures(tmpdir):
+    from .. import Database, Record
+    from ..bulk import import_items
+
+    original = '--- {}\n---\n_path: /\ncontent-type: text/html\n'
+    tmpdir.join('a.com.yaml').write(original)
+    db = Database(str(tmpdir))
+
+    items = [
+        {'_type': 'domain', 'domain': 'a.com', 'metadata': {}},
+        {'_type': 'record', 'domain': 'a.com', 'record': {'_path': '/new', 'content-type': 'text/plain'}},
+        {'_type': 'domain', 'domain': 'b.com', 'metadata': {}},
+        {'_type': 'record', 'domain': 'b.com', 'record': {'_path': '/'}},
+    ]
+
+    with pytest.raises(Exception, match='invalid record for b.com/'):
+        import_items(db, items)
+
+    assert tmpdir.listdir() == [tmpdir.join('a.com.yaml')]
+    assert tmpdir.join('a.com.yaml').read() == original
+
+    for dname in ['../escaped', 'a.com/sub', '..', None]:
+        with pytest.raises(Exception, match='illegal domain name'):
+            import_items(db, [{'_type': 'domain', 'domain': dname, 'metadata': {}}])
+
+    assert tmpdir.listdir() == [tmpdir.join('a.com.yaml')]
+    assert not tmpdir.dirpath().join('escaped.yaml').exists()
+
+    # Failures while writing don't leave temporary files behind either.
+    domain = db._get_domain('a.com')
+
+    def bad_records():
+        yield Record(domain, {'_path': '/', 'content-type': 'text/html'})
+        raise RuntimeError('oops')
+
+    with pytest.raises(RuntimeError):
+        domain._rewrite(bad_records())
+
+    assert tmpdir.listdir() == [tmpdir.join('a.com.yaml')]
+    assert tmpdir.join('a.com.yaml').read() == original
+
+
+def test_parallel_get_records(monkeypatch):
+    from .. import Database
+
+    db = Database()
+    expected = [rec.as_tuple() for rec in db.get_records()]
+
+    # The domain files should only be parsed by the worker processes.
+    def no_domains(dname):
+        raise AssertionError(f'{dname} was opened in the parent process')
+
+    monkeypatch.setattr(db, '_get_domain', no_domains)
+    assert [rec.as_tuple() for rec in db.get_records(processes=2)] == expected
+
+
+def test_bulk_import_locking(tmpdir):
+    import threading
+    from .. import Database
+    from ..bulk import import_items
+    from ..transaction import locked_domain
+
+    db = Database(str(tmpdir))
+    items = [
+        {'_type': 'domain', 'domain': 'example.com', 'metadata': {}},
+        {'_type': 'record', 'domain': 'example.com', 'record': {'_path': '/', 'content-type': 'text/html'}},
+    ]
+
+    with locked_domain(db, 'example.com'):
+        importer = threading.Thread(target=import_items, args=(db, items))
+        importer.start()
+        importer.join(0.5)
+        assert importer.is_alive()
+        assert not tmpdir.join('example.com.yaml').exists()
+
+    importer.join()
+    assert [rec.path for rec in Database(str(tmpdir)).get_records()] == ['/']
+
+
+def test_acheck_records_event_loop():
+    import asyncio
+    import threading
+    import time
+    from ..checking import acheck_records
+
+    class FakeRecord(object):
+        def __init__(self, delay):
+            self.delay = delay
+
+        def url(self):
+            return f'http://example.com/{self.delay}'
+
+        def _check(self, session, **kwargs):
+            time.sleep(self.delay)
+            return (None, [], False, 0)
+
+    pulled_in = set()
+
+    def records():
+        for delay in [0] + [2] * 10:
+            pulled_in.add(threading.get_ident())
+            yield FakeRecord(delay)
+
+    async def main():
+        results = acheck_records(records(), None, concurrency=4)
+        t0 = time.monotonic()
+
+        async for result in results:
+            assert result.problem is None
+            break
+
+        # Stopping early shouldn't wait for the slow checks.
+        await results.aclose()
+        return time.monotonic() - t0
+
+    assert asyncio.run(main()) < 1
+    assert threading.get_ident() not in pulled_in
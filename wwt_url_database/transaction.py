@@ -0,0 +1,190 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2020 the .NET Foundation
+# Distributed under the terms of the revised (3-clause) BSD license.
+
+"""Batched, locked modifications to the database.
+
+A :class:`Transaction` stages changes in memory. When it is committed, it
+takes an advisory lock on each domain file that it touches, rereads those
+files, applies the changes, and rewrites each file exactly once. Because the
+files are reread under the lock, concurrent writers can't lose each other's
+changes.
+
+The locks are taken on separate lock files, not on the domain files
+themselves, because the latter are replaced by atomic renames.
+
+"""
+import contextlib
+import os.path
+
+__all__ = '''
+Transaction
+TransactionError
+locked_domain
+'''.split()
+
+
+class TransactionError(Exception):
+    """Raised when staged changes can't be applied to the database."""
+
+
+if os.name == 'nt':
+    import msvcrt
+
+    def _lock_fd(fd):
+        # LK_LOCK gives up after ten seconds, so keep trying.
+        while True:
+            try:
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                pass
+
+    def _unlock_fd(fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _lock_fd(fd):
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+    def _unlock_fd(fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+@contextlib.contextmanager
+def locked_domain(db, dname):
+    """Hold an exclusive advisory lock on the domain file for *dname*.
+
+    This blocks until the lock is available.
+
+    """
+    path = os.path.join(db._dbdir, f'.{dname}.yaml.lock')
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+
+    try:
+        _lock_fd(fd)
+        try:
+            yield
+        finally:
+            _unlock_fd(fd)
+    finally:
+        os.close(fd)
+
+
+class Transaction(object):
+    """A set of staged changes to the database.
+
+    Records can be identified by URL, or by passing :class:`Record` objects.
+    Changes are applied in the order they were staged. Usually you'll get one
+    of these from :meth:`Database.transaction`.
+
+    """
+    def __init__(self, db):
+        self._db = db
+        self._ops = {}  # dname => list of (path, op, arg)
+
+    def _key(self, target):
+        if isinstance(target, str):
+            return self._db.normalize(target)
+        return (target._domain._domain, target.path)
+
+    def _stage(self, target, op, arg=None):
+        dname, path = self._key(target)
+        self._ops.setdefault(dname, []).append((path, op, arg))
+
+    def insert(self, record, replace=True):
+        """Stage the insertion of *record*.
+
+        If a record with the same path exists when the transaction is
+        committed, it is replaced, unless *replace* is false, in which case
+        the commit fails.
+
+        """
+        self._stage(record, 'insert' if replace else 'insert-new', record)
+
+    def update(self, record):
+        """Stage the replacement of an existing record by *record*.
+
+        The commit fails if the record doesn't exist.
+
+        """
+        self._stage(record, 'update', record)
+
+    def add_categories(self, target, *categories):
+        """Stage the addition of *categories* to an existing record."""
+        self._stage(target, 'add-categories', categories)
+
+    def remove_categories(self, target, *categories):
+        """Stage the removal of *categories* from an existing record."""
+        self._stage(target, 'remove-categories', categories)
+
+    def delete(self, target):
+        """Stage the deletion of an existing record."""
+        self._stage(target, 'delete')
+
+    def __len__(self):
+        return sum(len(ops) for ops in self._ops.values())
+
+    def touched_domains(self):
+        """Get a sorted list of the canonical names of the domains with staged changes."""
+        return sorted(self._ops.keys())
+
+    def _apply(self, domain, ops):
+        by_path = {rec.path: rec for rec in domain.records()}
+
+        for path, op, arg in ops:
+            rec = by_path.get(path)
+
+            if op == 'insert':
+                pass
+            elif op == 'insert-new':
+                if rec is not None:
+                    raise TransactionError(f'{domain._domain}{path} is already registered')
+            elif rec is None:
+                raise TransactionError(f'{domain._domain}{path} is not registered')
+
+            if op in ('insert', 'insert-new', 'update'):
+                arg._domain = domain
+                by_path[path] = arg
+            elif op == 'add-categories':
+                rec.categories.update(arg)
+            elif op == 'remove-categories':
+                rec.categories.difference_update(arg)
+            elif op == 'delete':
+                del by_path[path]
+
+        return [by_path[p] for p in sorted(by_path.keys())]
+
+    def commit(self):
+        """Apply all staged changes.
+
+        Locks are taken on every touched domain, in a consistent order to
+        avoid deadlocks, before anything is written. If any change can't be
+        applied, a :exc:`TransactionError` is raised and no files are
+        modified. Once committed, the transaction is empty and can be reused.
+
+        """
+        dnames = self.touched_domains()
+
+        with contextlib.ExitStack() as stack:
+            for dname in dnames:
+                stack.enter_context(locked_domain(self._db, dname))
+
+            # Reread everything under the locks, and apply all the changes in
+            # memory before writing anything.
+            rewrites = []
+
+            for dname in dnames:
+                domain = self._db._get_domain(dname)
+                rewrites.append((domain, self._apply(domain, self._ops[dname])))
+
+            for domain, records in rewrites:
+                domain._rewrite(records)
+
+        self._ops = {}
+
+    def rollback(self):
+        """Discard all staged changes."""
+        self._ops = {}
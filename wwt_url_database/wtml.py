@@ -0,0 +1,60 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2020 the .NET Foundation
+# Distributed under the terms of the revised (3-clause) BSD license.
+
+"""Extract URLs from WWT WTML collection files.
+
+WTML is the XML format used by WWT for its image collections. Folders,
+places and imagesets refer to thumbnails, tile pyramids, credits pages and
+so on through attributes like ``Url`` and ``Thumbnail`` and elements like
+``<ThumbnailUrl>``. Rather than knowing about all of them, we pick out
+every attribute value or element text that is an absolute HTTP(S) URL.
+
+Files are parsed incrementally, so large collections don't have to fit in
+memory.
+
+"""
+__all__ = '''
+extract_urls
+'''.split()
+
+
+def _as_url(text):
+    if text is None:
+        return None
+
+    text = text.strip()
+
+    if not text.startswith(('http://', 'https://')):
+        return None
+
+    # Tiled imagesets have URL templates like ".../{1}/{3}/{3}_{2}.png",
+    # which don't name real resources.
+    if '{' in text or ' ' in text:
+        return None
+
+    return text
+
+
+def extract_urls(source):
+    """Generate the absolute URLs referenced in a WTML document.
+
+    *source* is a filename or a binary file-like object. URLs are generated
+    in document order and may repeat. URL templates, which contain ``{``,
+    are skipped.
+
+    """
+    import xml.etree.ElementTree as etree
+
+    for _event, elem in etree.iterparse(source, events=('end',)):
+        for value in elem.attrib.values():
+            url = _as_url(value)
+            if url is not None:
+                yield url
+
+        url = _as_url(elem.text)
+        if url is not None:
+            yield url
+
+        # Children have already been processed, so free them.
+        elem.clear()